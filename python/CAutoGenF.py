@@ -6,8 +6,19 @@
 # SPDX-License-Identifier : GPL-3.0-or-later
 
 
-import numpy as np
+import functools
+import hashlib
+import io
+import os
 import re
+import threading
+
+from cag_ir import Argument, Docstring, Document, Module, Procedure, TypeDef
+
+__version__ = '1.0.0'
+# Version of the output of parse(), to be increased whenever it changes so that the parse
+# results stored by a cache are invalidated.
+PARSER_VERSION = 3
 
 NO_COLOR  = "\033[0m"
 GREEN     = "\033[32;01m"
@@ -19,9 +30,431 @@ class CAGError( Exception ):
         self.message = message
         super().__init__( self.message )
 
+def failure( error ):
+    """
+    Message of an unexpected exception raised while documenting a file, reported as the error
+    of the file (as a CAGError is) instead of aborting the run.
+    """
+    return f"cannot be documented ({type( error ).__name__}: {error})."
+
 types = ['real', 'double', 'complex', 'integer', 'character', 'type', 'logical', 'class']
 procs  = ['subroutine', 'function']#, 'program']# , 'type']
 
+# Kinds of the events yielded by scan()
+DOC      = 'doc'        # !! line, value is the text
+VAR_DOC  = 'var_doc'    # !> line, value is the text or None for an empty !>
+PROC     = 'proc'       # procedure header, value is the list of its (continued) lines
+END      = 'end'        # end of a procedure
+DECL     = 'decl'       # declaration, value is the list of its (continued) lines
+CONTAINS = 'contains'   # contains statement, nothing is documented past it
+# Only yielded when scanning a whole module
+MODULE        = 'module'         # module or submodule statement, value is the line
+INTERFACE     = 'interface'      # start of an interface block
+END_INTERFACE = 'end_interface'
+END_TYPE      = 'end_type'
+
+# Matches every line that may produce an event, all the other code lines are skipped without
+# being split unless a statement is continued.
+_events  = r"\s*(?:!!|!>|(?i:contains)(?!\S)|(?:%s)(?![^\s(,])|.*?(?<!\S)(?:%s)(?!\S)" % ('|'.join( types ), '|'.join( procs ))
+_scanner = re.compile( _events + ')' )
+_scanner_whole = re.compile( _events + r"|(?i:(?:abstract\s+)?interface|end\s*(?:type|interface|procedure)|(?:sub)?module)(?!\w))" )
+
+# Fortran include line or preprocessor #include, with the bracket of the latter
+_include_body = r"[ \t]*(?:#[ \t]*include[ \t]*([\"<])([^\">\n]+)[\">]|(?i:include)[ \t]*[\"']([^\"'\n]+)[\"'])"
+_include  = re.compile( _include_body )
+_includes = re.compile( '^' + _include_body, re.M )
+
+# Definition of a derived type (and not declaration of a variable of derived type)
+_typedef = re.compile( r"type\s*(?:,[^:]*)?::\s*(\w+)|type\s+(\w+)", re.I )
+
+# Type and entities of a declaration without ::, e.g. real(dp) x or type point
+_old_decl = re.compile( r"((?:double\s+precision|\w+)\s*(?:\((?:[^()]|\([^()]*\))*\)|\*\s*\w+)?)\s*(.*)", re.I )
+
+def _code( line ):
+    """
+    Return the code part of a line without its trailing &, and whether the line is continued.
+    """
+    code = line.replace('\n', '').split( sep='!' )[0]
+    if code[-1] == '&':
+        return code[:-1].strip( ), True
+    return code.strip( ), False
+
+def _proc_line( line, whole=False ):
+    """
+    Classify a line of a procedure header: None if the procedure name was only found in a format,
+    print or write statement, END if it closes a procedure, PROC otherwise.
+    """
+    words = line.replace( '(', ' ').replace( ',', ' ').replace( '*', ' ').split( )
+    if any( w in words[:2] for w in ['format', 'print', 'write'] ):
+        return None
+    if whole:
+        # only end statements, so that e.g. "subroutine append" is not taken for one
+        if words[0].lower().startswith( 'end' ):
+            return END
+    elif 'end' in line.replace('\n', '').split( sep='!' )[0]:
+        return END
+    return PROC
+
+def _block( words, contained=False ):
+    """
+    Return the event of a module, interface or end type statement, or None. Past a contains,
+    the module procedure statements of a submodule open a procedure and end procedure closes it.
+    """
+    w0 = words[0].lower()
+    w1 = words[1].lower() if len( words ) > 1 else ''
+    if w0 in ('module', 'submodule') and w1 != 'procedure' and not any( p in words for p in procs ):
+        return MODULE
+    if contained and w0 == 'module' and w1 == 'procedure':
+        return PROC
+    if w0 == 'endprocedure' or (w0 == 'end' and w1 == 'procedure'):
+        return END
+    if w0 == 'interface' or (w0 == 'abstract' and w1 == 'interface'):
+        return INTERFACE
+    if w0 == 'endinterface' or (w0 == 'end' and w1 == 'interface'):
+        return END_INTERFACE
+    if w0 == 'endtype' or (w0 == 'end' and w1 == 'type'):
+        return END_TYPE
+    return None
+
+def scan( lines, whole=False, include=None ):
+    """
+    Read an iterable of Fortran lines (e.g. an open file) and yield ``(kind, lineno, value)``
+    events. Continued procedure headers and declarations are yielded as a single event once
+    complete; the doc lines found in between are yielded right after them.
+
+    By default the scan stops at the first contains. If whole is True, the whole file is read
+    and the module, interface and end type statements are yielded as well.
+
+    If include is given, it is called with the match of every include line and returns the
+    events of the included file, yielded in place of the line (with its line number).
+    """
+    scanner = _scanner_whole if whole else _scanner
+    stmt    = None  # [kind, lineno, lines] of the continued statement being read
+    pending = []
+    # past the contains of a module (and not of a type definition)
+    contained = False
+
+    def flush( ):
+        nonlocal stmt
+        if stmt is not None:
+            yield tuple( stmt )
+            stmt = None
+        yield from pending
+        pending.clear( )
+
+    for i, line in enumerate( lines ):
+        if stmt is None and scanner.match( line ) is None:
+            match = include and _include.match( line )
+            if match:
+                for kind, _, value in include( match ):
+                    yield (kind, i, value)
+            continue
+        words = line.split( )
+        if not words:
+            continue
+        w0 = words[0]
+
+        if whole and stmt is None and w0[0] != '!':
+            kind = _block( words, contained )
+            if kind is not None:
+                if kind == PROC:
+                    yield (kind, i, [_code( line )[0]])
+                else:
+                    yield (kind, i, _code( line )[0] if kind == MODULE else None)
+                contained = contained and kind not in (MODULE, END_TYPE)
+                continue
+
+        if len( words ) == 1:
+            if w0.lower() == 'contains':
+                yield from flush( )
+                yield (CONTAINS, i, None)
+                if whole:
+                    contained = True
+                    continue
+                return
+            if w0 == '!!':
+                event = (DOC, i, ' ')
+            elif w0 == '!>':
+                event = (VAR_DOC, i, None)
+            else:
+                continue
+        elif len( w0 ) == 1:
+            continue
+        elif w0[0] == '!':
+            if w0[1] == '!':
+                kind = DOC
+            elif w0[1] == '>':
+                kind = VAR_DOC
+            else:
+                continue
+            words[0] = w0[2:]
+            event = (kind, i, ' '.join( words ))
+        elif w0.lower() == 'contains':
+            yield from flush( )
+            yield (CONTAINS, i, None)
+            if whole:
+                contained = True
+                continue
+            return
+        else:
+            in_proc = stmt is not None and stmt[0] == PROC
+            # in a whole module, the words of the trailing comments of the procedure bodies
+            # are not taken for a procedure header
+            if any( p in (_code( line )[0].split( ) if whole else words) for p in procs ) or in_proc:
+                kind = _proc_line( line, whole )
+                if not in_proc:
+                    yield from flush( )
+                if kind is None or kind == END:
+                    yield from flush( )
+                    if kind == END:
+                        yield (END, i, None)
+                    continue
+            elif w0.split( sep='(' )[0].split( sep=',' )[0] in types:
+                yield from flush( )
+                kind = DECL
+            elif stmt is not None:
+                kind = DECL
+            else:
+                continue
+
+            code, continued = _code( line )
+            if stmt is None:
+                stmt = [kind, i, []]
+            stmt[2].append( code )
+            if not continued:
+                yield from flush( )
+            continue
+
+        if stmt is None:
+            yield event
+        else:
+            pending.append( event )
+
+    yield from flush( )
+
+def _same_content( fname1, fname2, bufsize=2**16 ):
+    if os.path.getsize( fname1 ) != os.path.getsize( fname2 ):
+        return False
+    with open( fname1, 'rb' ) as f1, open( fname2, 'rb' ) as f2:
+        while True:
+            b1 = f1.read( bufsize )
+            if b1 != f2.read( bufsize ):
+                return False
+            if not b1:
+                return True
+
+def write_if_changed( fname, emit ):
+    """
+    Write the chunks given by emit( write ) to a temporary file which atomically replaces fname
+    only if their contents differ, so that an up to date output keeps its modification time
+    and does not trigger a rebuild of the documents including it. Return True if fname was
+    (re)written.
+    """
+    directory, base = os.path.split( fname )
+    tmp = os.path.join( directory, f".{base}.{os.getpid()}.{threading.get_ident()}.tmp" )
+    try:
+        with open( tmp, 'w' ) as f:
+            emit( f.write )
+        if os.path.isfile( fname ) and _same_content( tmp, fname ):
+            os.unlink( tmp )
+            return False
+        os.replace( tmp, fname )
+    except BaseException:
+        if os.path.exists( tmp ):
+            os.unlink( tmp )
+        raise
+    return True
+
+# Transforms of the text of the docstrings applied when writing LaTeX. They are memoized: the
+# same descriptions (e.g. of the arguments of the variants of a procedure) are found in many
+# files.
+TEXT_CACHE_SIZE = 2**14
+
+PARAGRAPH   = 'paragraph'    # paragraph of the core of a docstring
+VAR         = 'var'          # raw description of a variable
+DESCRIPTION = 'description'  # description of a variable, made of a transformed VAR
+ITEM        = 'item'         # reference, history, author or advisor
+
+_capitalize_re = re.compile( r"(^|[.?!])\s*([a-zA-Z])" )
+
+def _capitalize( string ):
+    string = _capitalize_re.sub( lambda p: p.group(0).upper(), string )
+    return string.replace( 'e.G.', 'e.g.' ).replace( '.F', '.f' )
+
+def _point( text ):
+    stext = text.strip()
+    if not stext: return stext
+    if stext[-1] not in '.!?': return stext + '.'
+    return stext
+
+def _spans( text, sep, macro, links=None ):
+    """
+    Put every other part of text delimited by sep in the LaTeX macro. If links is given, the
+    parts which are linked symbols are put in a \\hyperref as well.
+    """
+    stext = text.strip()
+    if not stext: return text
+    if sep not in stext:
+        return stext.replace( ' .', '.').replace( ' ,', ',')
+    ltext = stext.split( sep )
+    for i in range( 1, len( ltext ), 2 ):
+        label = links.get( ltext[i].strip( ).lower( ) ) if links else None
+        ltext[i] = '\\%s{%s}' % (macro, ltext[i])
+        if label is not None:
+            ltext[i] = '\\hyperref[%s]{%s}' % (label, ltext[i])
+    return ' '.join( ltext ).replace( ' .', '.').replace( ' ,', ',')
+
+def _clean( text, links=None ):
+    # identifiers in backquotes, out of the $ math mode $
+    ltext = text.split( '$' )
+    for i in range( len( ltext ) // 2 + 1 ):
+        ltext[2*i] = _spans( ltext[2*i], '`', 'code', links )
+    return r'\xspace$\xspace '.join( ltext )
+
+def _bold( text ):
+    return _spans( text, '#', 'textbf' )
+
+@functools.lru_cache( maxsize=TEXT_CACHE_SIZE )
+def _transform( kind, text, links=() ):
+    links = dict( links )
+    if kind == PARAGRAPH:
+        return _bold( _clean( text, links ) )
+    if kind == VAR:
+        return _bold( _point( text ) )
+    if kind == DESCRIPTION:
+        return _bold( _point( _capitalize( _clean( text, links ) ) ) )
+    if kind == ITEM:
+        return _point( _capitalize( _clean( text, links ) ) )
+    raise ValueError( kind )
+
+def text_cache_info( ):
+    """
+    Return the hits, misses, maxsize and currsize of the memo of the text transforms.
+    """
+    return _transform.cache_info( )
+
+def text_cache_clear( ):
+    """
+    Empty the memo of the text transforms, e.g. to time them.
+    """
+    _transform.cache_clear( )
+
+def _lines( text ):
+    """
+    Yield the lines of a string, with their end of line, as iterating over a file does.
+    """
+    start = 0
+    while True:
+        end = text.find( '\n', start )
+        if end < 0:
+            if start < len( text ):
+                yield text[start:]
+            return
+        yield text[start:end+1]
+        start = end + 1
+
+def decode( data, encoding=None ):
+    """
+    Decode the content of a source (bytes or any bytes-like object, e.g. a memoryview) the same
+    way as open() does: with the locale encoding by default, and universal newlines.
+    """
+    if encoding is None:
+        # imported here as it is slow to import and only needed to decode bytes
+        import locale
+        encoding = locale.getpreferredencoding( False )
+    text = str( data, encoding )
+    if '\r' in text:
+        text = text.replace( '\r\n', '\n' ).replace( '\r', '\n' )
+    return text
+
+class IncludeCache( ):
+    """
+    Cache of the include files shared by all the sources parsed by a process: an include file
+    is read once (and again only if its modification time or size changed) and scanned once
+    per scan mode, however many sources include it. The scanned fragments are keyed by the
+    path and digest of the file and of the files it includes.
+    """
+
+    def __init__( self ):
+        self.files  = {}  # path: (stat signature, digest, text)
+        self.events = {}  # (path, digest of its includes, whole, directories): events
+        self.reads  = 0
+        self.scans  = 0
+
+    def file( self, fname ):
+        """
+        Return the (stat signature, digest, text) of an include file.
+        """
+        st    = os.stat( fname )
+        sig   = (st.st_mtime_ns, st.st_size)
+        entry = self.files.get( fname )
+        if entry is None or entry[0] != sig:
+            with open( fname, 'rb' ) as f:
+                data = f.read( )
+            entry = self.files[fname] = (sig, hashlib.sha256( data ).hexdigest( ), decode( data ))
+            self.reads += 1
+        return entry
+
+    @staticmethod
+    def resolve( match, directory, dirs=() ):
+        """
+        Return the path of the file of an include line (a match of _include), searched in the
+        directory of the including file (except for #include <...>) then in dirs, or None if
+        it is not found (e.g. a system header).
+        """
+        bracket, cpp, name = match.groups( )
+        for d in ([] if bracket == '<' else [directory]) + list( dirs ):
+            fname = os.path.join( d, cpp or name )
+            if os.path.isfile( fname ):
+                return os.path.normpath( os.path.abspath( fname ) )
+        return None
+
+    def closure( self, text, directory, dirs=() ):
+        """
+        Return the paths of the files included by a source, recursively, in the order of their
+        first inclusion.
+        """
+        found = {}
+        def visit( text, directory ):
+            for match in _includes.finditer( text ):
+                fname = self.resolve( match, directory, dirs )
+                if fname is not None and fname not in found:
+                    found[fname] = None
+                    visit( self.file( fname )[2], os.path.dirname( fname ) )
+        visit( text, directory )
+        return list( found )
+
+    def key( self, text, directory, dirs=() ):
+        """
+        Digest of the paths and contents of the files included by a source, '' if none.
+        """
+        fnames = self.closure( text, directory, dirs )
+        if not fnames:
+            return ''
+        return hashlib.sha256( ''.join( f"{f}\0{self.file( f )[1]}\0" for f in fnames ).encode( ) ).hexdigest( )
+
+    def fragment( self, fname, whole=False, dirs=(), stack=() ):
+        """
+        Return the events of scan() of an include file, its own include lines expanded. stack
+        is the chain of the include files being expanded: a recursive inclusion is skipped.
+        """
+        if fname in stack:
+            return ()
+        _, digest, text = self.file( fname )
+        directory = os.path.dirname( fname )
+        key    = (fname, digest + self.key( text, directory, dirs ), whole, dirs)
+        events = self.events.get( key )
+        if events is None:
+            def include( match ):
+                found = self.resolve( match, directory, dirs )
+                return self.fragment( found, whole, dirs, stack + (fname,) ) if found else ()
+            events = self.events[key] = tuple( scan( _lines( text ), whole, include ) )
+            self.scans += 1
+        return events
+
+# the include files read by this process
+INCLUDES = IncludeCache( )
+
 class CAutoGenF( ):
 
     all_variables = {"mod_kind", "mod_communicate", "submod_error", "mod_hdf5_utils", "slatec",
@@ -34,7 +467,8 @@ class CAutoGenF( ):
         "submod_etat_mhd", "submod_etat_opal5Z", "submod_etat_saha", "mod_conv", "mod_nuc", "mod_thermo",
         "mod_atm", "mod_alecian", "mod_evol", "submod_evol2d", "mod_static", "mod_cesam", "mod_exploit"}
 
-    def __init__( self, name, path='.', out='out.tex', depth=1, ttype=False, pprog=False, write_vars=True ):
+    def __init__( self, name, path='.', out='out.tex', depth=1, ttype=False, pprog=False, write_vars=True,
+        cache=None, whole=False, links=None, includes=None ):
         self.path       = path
         self.name       = name
         self.out        = out
@@ -45,47 +479,18 @@ class CAutoGenF( ):
         self.prog       = pprog
         # If False, don't write the documentation for the arguments
         self.write_vars = write_vars
-
-    def __deal_with_var_decl( self, line, vari, parent, init_dict=None ):
-        _dict = self.dict[parent] if init_dict is None else init_dict
-        words2 = line.replace('\n', '').split( sep='!' )
-        if words2[0][-1] != '&':
-            in_var_decl = False
-            _dict['vars'][vari]['decl'].append( words2[0].strip( ) )
-        else:
-            in_var_decl = True
-            _dict['vars'][vari]['decl'].append( words2[0][:-1].strip( ) )
-        return in_var_decl
-
-    def __deal_with_proc_decl( self, i, line, parent, new_decl=False ):#, init_dict=None ):
-        # First look if the procedure name was find in a format, print or write statement
-        line_tmp = line.replace( '(', ' ').replace( ',', ' ').replace( '*', ' ')
-        words1 = line_tmp.split( )
-        if self.__is_in_list( ['format', 'print', 'write'], words1[:2]):
-            return None, parent
-        words2 = line.replace('\n', '').split( sep='!' )
-
-
-        if 'end' in words2[0]:
-            in_proc_decl = False
-            parent       = ''
-        elif words2[0][-1] == '&':
-            in_proc_decl = True
-            if not parent:
-                parent = f"{i:05d}"
-                self.vari = -1
-            if parent not in list( self.dict.keys() ):
-                self.dict[parent] = {'doc' : [], 'proc' : [], 'vars' : []}
-            self.dict[parent]['proc'].append( words2[0][:-1].strip( ) )
-        else:
-            in_proc_decl = False
-            if not parent:
-                parent = f"{i:05d}"
-                self.vari = -1
-            if parent not in list( self.dict.keys() ):
-                self.dict[parent] = {'doc' : [], 'proc' : [], 'vars' : []}
-            self.dict[parent]['proc'].append( words2[0].strip( ) )
-        return in_proc_decl, parent
+        # Optional store of the parse results (see cag_cache.ParseCache)
+        self.cache      = cache
+        # If True, parse the whole module (or submodule) file, past the contains statements.
+        self.whole      = whole
+        # Optional map of the (lower case) names of the documented symbols to their label, the
+        # identifiers in backquotes found in a symbol are linked to its section.
+        self.links      = links
+        # If True, parse() keeps the line numbers of the docs and declarations, for check().
+        self.linenos    = False
+        # If not None, the include lines are replaced by the docs and declarations of the files
+        # they include, searched in the directory of the source then in these directories.
+        self.includes   = None if includes is None else tuple( includes )
 
     def __is_in_list( self, list1, list2, out=False):
         for elem in list1:
@@ -100,12 +505,24 @@ class CAutoGenF( ):
             return False
 
     def __capitalize( self, string):
-        string = re.sub( "(^|[.?!])\s*([a-zA-Z])", lambda p: p.group(0).upper(), string )
-        string = string.replace( 'e.G.', 'e.g.' )
-        string = string.replace( '.F', '.f' )
-        return string
+        return _capitalize( string )
 
-    def __process_docstring( self, lines ):
+    def __text( self, kind, text ):
+        """
+        Memoized transform of a text. Only the links of the symbols it references are part of
+        the key, so that texts are shared by files with different links.
+        """
+        links = ()
+        if self.links and '`' in text:
+            links = tuple( sorted( (name, self.links[name]) for name in
+                {r.strip( ).lower( ) for r in text.split( '`' )[1::2]} if name in self.links ) )
+        return _transform( kind, text, links )
+
+    def __process_docstring( self, lines, errors=None ):
+        """
+        Split the lines of a docstring into its sections. If errors is a list, the problems are
+        appended to it as (index of the line, message) instead of being raised.
+        """
         core        = ['']
         references  = {}
         history     = {}
@@ -114,75 +531,89 @@ class CAutoGenF( ):
 
         in_bools = {'reference':False, 'history':False, 'orig_author':False, 'advisor':False}
 
-        for line in lines:
-            words = line.split()
-            if len(words) == 0:
-                if not np.array( list( in_bools.values() ) ).any():
-                    core.append( '\n' )
-                    core.append( '' )
-
-            elif ':' in [words[0], words[0][0]]:
-                if words[0] == ':':
-                    arg = words[1].replace(':', '')
-                    words = words[2:]
+        arg = None
+        for n, line in enumerate( lines ):
+            try:
+                words = line.split()
+                if len(words) == 0:
+                    if not any( in_bools.values() ):
+                        core.append( '\n' )
+                        core.append( '' )
+
+                elif ':' in [words[0], words[0][0]]:
+                    if words[0] == ':':
+                        arg = words[1].replace(':', '')
+                        words = words[2:]
+                    else:
+                        arg = words[0][1:].replace(':', '')
+                        words = words[1:]
+
+                    if arg == 'reference':
+                        name = words[0].replace(':', '').strip()
+
+                        if len( words ) == 1:
+                            raise CAGError( f"{arg} was defined but no description was provided." )
+                        elif words[1] == ':':
+                            del words[1]
+
+                        if len( words ) > 1:
+                            references[name] = ' '.join( words[1:] )
+
+                    elif arg == 'history':
+                        name = words[0].replace(':', '').strip()
+                        if len( words ) == 1:
+                            raise CAGError( f"{arg} was defined but no description was provided." )
+                        elif words[1] == ':':
+                            del words[1]
+
+                        if len( words ) > 1:
+                            history[name] = ' '.join( words[1:] )
+
+                    elif arg == 'author':
+                        # entries are numbered in order of appearance
+                        name = f"{len( orig_author ):08X}"
+                        if len( words ) == 1:
+                            raise CAGError( f"{arg} was defined but no description was provided." )
+                        elif words[0] == ':':
+                            del words[0]
+
+                        if len( words ) > 1:
+                            orig_author[name] = ' '.join( words )
+
+                    elif arg == 'advisor':
+                        name = f"{len( advisor ):08X}"
+                        if len( words ) == 1:
+                            raise CAGError( f"{arg} was defined but no description was provided." )
+                        elif words[0] == ':':
+                            del words[0]
+
+                        if len( words ) > 1:
+                            advisor[name] = ' '.join( words )
+
+                    elif errors is not None:
+                        errors.append( (n, f"unknown tag :{arg}:.") )
+
+                    in_bools = in_bools.fromkeys( in_bools, False )
+                    in_bools[arg] = True
+
+                elif in_bools['reference']:
+                    references[name]       += ' ' + ' '.join( words )
+                elif in_bools['history']:
+                    history[name]          += ' ' + ' '.join( words )
+                elif in_bools['orig_author']:
+                    orig_author[name]          += ' ' + ' '.join( words )
+                elif in_bools['advisor']:
+                    advisor[name]          += ' ' + ' '.join( words )
                 else:
-                    arg = words[0][1:].replace(':', '')
-                    words = words[1:]
-
-                if arg == 'reference':
-                    name = words[0].replace(':', '').strip()
-
-                    if len( words ) == 1:
-                        raise CAGError( f"{arg} was defined but no description was provided." )
-                    elif words[1] == ':':
-                        del words[1]
-
-                    if len( words ) > 1:
-                        references[name] = ' '.join( words[1:] )
-
-                elif arg == 'history':
-                    name = words[0].replace(':', '').strip()
-                    if len( words ) == 1:
-                        raise CAGError( f"{arg} was defined but no description was provided." )
-                    elif words[1] == ':':
-                        del words[1]
-
-                    if len( words ) > 1:
-                        history[name] = ' '.join( words[1:] )
-
-                elif arg == 'author':
-                    name = f"{np.random.randint(2**30, size=1)[0]:8X}"
-                    if len( words ) == 1:
-                        raise CAGError( f"{arg} was defined but no description was provided." )
-                    elif words[0] == ':':
-                        del words[0]
-
-                    if len( words ) > 1:
-                        orig_author[name] = ' '.join( words )
-
-                elif arg == 'advisor':
-                    name = f"{np.random.randint(2**30, size=1)[0]:8X}"
-                    if len( words ) == 1:
-                        raise CAGError( f"{arg} was defined but no description was provided." )
-                    elif words[0] == ':':
-                        del words[0]
-
-                    if len( words ) > 1:
-                        advisor[name] = ' '.join( words )
-
-                in_bools = in_bools.fromkeys( in_bools, False )
-                in_bools[arg] = True
-
-            elif in_bools['reference']:
-                references[name]       += ' ' + ' '.join( words )
-            elif in_bools['history']:
-                history[name]          += ' ' + ' '.join( words )
-            elif in_bools['orig_author']:
-                orig_author[name]          += ' ' + ' '.join( words )
-            elif in_bools['advisor']:
-                advisor[name]          += ' ' + ' '.join( words )
-            else:
-                core[-1] += ' ' + ' '.join( words )
+                    core[-1] += ' ' + ' '.join( words )
+            except ( CAGError, IndexError, KeyError ) as e:
+                if errors is None:
+                    raise
+                if isinstance( e, CAGError ):
+                    message = e.message
+                else:
+                    message = f"malformed {arg} tag." if arg else "malformed tag."
+                errors.append( (n, message) )
 
         docstring = {
             'core':core,
@@ -203,12 +634,15 @@ class CAutoGenF( ):
         else:
             return [var, '']
 
-    def __write_var( self, var ):
+    def __write_var( self, var, all_vars=False ):
         decl = ''.join(var['decl'])
-        if 'intent' not in decl and not (self.type or self.prog): return None, None, None
+        if 'intent' not in decl and not (self.type or self.prog or all_vars): return None, None, None
 
         doc  = var['doc']
-        decl = decl.split( sep='::' )
+        if '::' in decl:
+            decl = decl.split( sep='::' )
+        else:
+            decl = list( _old_decl.fullmatch( decl.strip( ) ).groups( ) )
         vrs  = self.__get_default( decl[1].strip() )
         decl = decl[0].strip( )
         decl = decl.replace('l (', 'l(').replace('s (', 's(').replace('e (', 'e(')
@@ -217,292 +651,473 @@ class CAutoGenF( ):
 
     def parse( self ):
         print(f"Parsing {self.path}/{self.name}...", end='')
-        with open( self.path+'/'+self.name ) as f:
-            lines = f.readlines()
-
-        if self.type:
-            self.dict    = {'':{'doc' : [], 'proc' : [], 'vars' : []}}
-        elif self.prog:
-            self.dict    = {'':{'doc' : [], 'proc' : [], 'vars' : []}}
-        else:
-            self.dict    = {}
-        self.init_dict    = {'doc' : [], 'proc' : [], 'vars' : []}
-        new_lines    = []
-        var_doc      = []
-        parent       = ''
-        in_var_doc   = False
-        in_var_decl  = False
-        in_proc_decl = False
-        self.vari         = -1
-        for i, line in enumerate( lines ):
-            words = line.split( )
-
-            if len( words ) > 1 :
-                if len( words[0] ) > 1:
-                    if words[0][0] == '!':
-                        if words[0][1] == '!':
-                            # in description
-                            words[0] = words[0][2:]
-                            if parent or self.type or self.prog:
-                                self.dict[parent]['doc'].append( ' '.join( words ) )
-                            #else:
-                            #    self.init_dict['doc'].append( ' '.join( words ) )
-                        elif words[0][1] == '>':
-                            # in variable description
-                            words[0] = words[0][2:]
-                            if in_var_doc:
-                                var_doc.append( ' '.join( words ) )
-                            else:
-                                in_var_doc = True
-                                var_doc    = [' '.join( words )]
-                    else:
-                        if words[0].lower() == 'contains':
-                            break
-                        if self.__is_in_list( procs, words ):
-                            in_proc_decl_tmp, parent = self.__deal_with_proc_decl( i, line, parent,
-                                new_decl=True)#, init_dict=self.init_dict )
-                            in_proc_decl = False if in_proc_decl_tmp is None else in_proc_decl_tmp
-
-                        elif in_proc_decl:
-                            in_proc_decl_tmp, parent = self.__deal_with_proc_decl( i, line, parent )
-                            in_proc_decl = False if in_proc_decl_tmp is None else in_proc_decl_tmp
-
-                        elif words[0].split(sep='(')[0].split( sep=',' )[0] in types:
-                            in_var_doc  = False
-                            self.vari += 1
-                            if parent or self.type or self.prog:
-                                self.dict[parent]['vars'].append( {'decl':[], 'doc':var_doc} )
-                            in_var_decl = self.__deal_with_var_decl( line, self.vari, parent )
-
-                        elif in_var_decl:
-                            in_var_decl = self.__deal_with_var_decl( line, self.vari, parent )
-
-
-                        elif in_proc_decl:
-                            in_proc_decl, parent = self.__deal_with_proc_decl( i, line, parent )
-            if len( words ) == 1:
-                if words[0].lower() == 'contains':
-                            break
-                if words[0] == '!!':
-                    if parent or self.type or self.prog:
-                        self.dict[parent]['doc'].append( ' ' )
-                    #else:
-                    #    self.init_dict['doc'].append( ' ' )
-                elif words[0] == '!>':
-                    if in_var_doc:
-                        var_doc[-1] += '\\\\'
-                        #var_doc.append( ' ' )
-                    else:
-                        in_var_doc = True
-                        var_doc    = [' ']
-
-    def __clean_underscores2( self, text ):
-        stext = text.strip()
-        if len(stext):
-            add = 1
-            ltext = stext.split( sep='`' )
 
-            n = len( ltext ) // 2 + 1 - add
-            for i in range( n ):
-                ltext[2*i+add] = '\\code{' + ltext[2*i+add] + '}'
+        fname = self.path+'/'+self.name
+        if self.includes is not None:
+            # the parse result depends on the include files, found in the content
+            with open( fname, 'rb' ) as f:
+                return self.parse_source( f.read( ) )
+        if self.cache is not None:
+            key = self.cache.key( fname, self.type, self.prog, self.whole )
+            self.dict = self.cache.get( key )
+            if self.dict is not None:
+                return
 
-            text = ' '.join( ltext )
+        with open( fname ) as f:
+            self.parse_lines( f )
 
-            text = text.replace( ' .', '.').replace( ' ,', ',')
+        if self.cache is not None:
+            self.cache.put( key, self.dict )
 
-        return text
-
-    def __bold_font( self, text ):
-        stext = text.strip()
-        if len(stext):
-            add = 1
-            ltext = stext.split( sep='#' )
-
-            n = len( ltext ) // 2 + 1 - add
-            for i in range( n ):
-                ltext[2*i+add] = '\\textbf{' + ltext[2*i+add] + '}'
+    def parse_source( self, source, encoding=None ):
+        """
+        Parse a source held in memory instead of the file self.path/self.name: a str, bytes or
+        any bytes-like object (decoded once, see decode()), or an open text or binary stream.
+        The cache, if any, is only used for bytes-like sources.
+        """
+        if isinstance( source, (io.RawIOBase, io.BufferedIOBase) ):
+            source = source.read( )
+        if isinstance( source, str ):
+            lines = _lines( source.replace( '\r\n', '\n' ).replace( '\r', '\n' ) if '\r' in source else source )
+        elif hasattr( source, 'read' ):
+            lines = source
+        else:
+            if self.cache is not None:
+                key = self.cache.key_data( source, self.type, self.prog, self.whole, self.include_key( source ) )
+                self.dict = self.cache.get( key )
+                if self.dict is not None:
+                    return
+            self.parse_lines( _lines( decode( source, encoding ) ) )
+            if self.cache is not None:
+                self.cache.put( key, self.dict )
+            return
+        self.parse_lines( lines )
+
+    def include_key( self, data ):
+        """
+        Digest of the files included by a source (bytes), to be added to the keys of its parse
+        result and outputs: '' if the include lines are skipped or nothing is included.
+        """
+        if self.includes is None:
+            return ''
+        return INCLUDES.key( decode( data ), self.__directory( ), self.includes )
 
-            text = ' '.join( ltext )
+    def __directory( self ):
+        return os.path.dirname( os.path.join( self.path, self.name ) )
 
-            text = text.replace( ' .', '.').replace( ' ,', ',')
+    def __include( self, match ):
+        fname = INCLUDES.resolve( match, self.__directory( ), self.includes )
+        if fname is None:
+            return ()
+        return INCLUDES.fragment( fname, self.whole, self.includes )
 
-        return text
+    def parse_lines( self, lines ):
+        """
+        Parse an iterable of lines (e.g. an open file) into self.dict. If self.includes is not
+        None, the docs and declarations of the included files are merged into the unit which
+        includes them, as if they were written in place of the include line.
+        """
+        include = self.__include if self.includes is not None else None
+        if self.whole:
+            return self.__parse_whole( lines, include )
 
-    def __point( self, text ):
-        stext = text.strip()
-        if len( stext ) == 0: return stext
-        if stext[-1] not in ['.', '!', '?']: return stext + '.'
-        return stext
+        if self.type or self.prog:
+            self.dict    = {'':{'doc' : [], 'proc' : [], 'vars' : []}}
+        else:
+            self.dict    = {}
+        var_doc      = []
+        parent       = ''
+        in_var_doc   = False
+        linenos      = self.linenos
+        for kind, i, value in scan( lines, include=include ):
+            if kind == DOC:
+                # in description
+                if parent or self.type or self.prog:
+                    self.dict[parent]['doc'].append( value )
+                    if linenos:
+                        self.dict[parent].setdefault( 'doc_lines', [] ).append( i )
+            elif kind == VAR_DOC:
+                # in variable description
+                if value is None and in_var_doc:
+                    var_doc[-1] += '\\\\'
+                elif in_var_doc:
+                    var_doc.append( value )
+                else:
+                    in_var_doc = True
+                    var_doc    = [' ' if value is None else value]
+            elif kind == PROC:
+                if not parent:
+                    parent = f"{i:05d}"
+                if parent not in self.dict:
+                    self.dict[parent] = {'doc' : [], 'proc' : [], 'vars' : []}
+                self.dict[parent]['proc'].extend( value )
+            elif kind == END:
+                parent = ''
+            elif kind == DECL:
+                if parent or self.type or self.prog:
+                    self.dict[parent]['vars'].append( {'decl':value, 'doc':var_doc} )
+                    if linenos:
+                        self.dict[parent]['vars'][-1].update( line=i, own_doc=in_var_doc )
+                in_var_doc = False
+            elif kind == CONTAINS:
+                break
+
+    def __parse_whole( self, lines, include=None ):
+        """
+        Parse a whole module file: every module, derived type and procedure is a unit of
+        self.dict, whose 'unit' entry is 'module', 'type' or 'procedure'. Procedures declared
+        in interface blocks are skipped, they are documented where they are implemented.
+        """
+        self.dict    = {}
+        var_doc      = []
+        in_var_doc   = False
+        parent       = ''
+        # parent of the current type definition
+        outer        = None
+        interface    = 0
+        for kind, i, value in scan( lines, whole=True, include=include ):
+            if kind == INTERFACE:
+                interface += 1
+            elif kind == END_INTERFACE:
+                interface = max( interface - 1, 0 )
+            elif interface:
+                continue
+            elif kind == DOC:
+                if parent:
+                    self.dict[parent]['doc'].append( value )
+                    if self.linenos:
+                        self.dict[parent].setdefault( 'doc_lines', [] ).append( i )
+            elif kind == VAR_DOC:
+                if value is None and in_var_doc:
+                    var_doc[-1] += '\\\\'
+                elif in_var_doc:
+                    var_doc.append( value )
+                else:
+                    in_var_doc = True
+                    var_doc    = [' ' if value is None else value]
+            elif kind in (MODULE, PROC):
+                parent = f"{i:05d}"
+                self.dict[parent] = {'unit': 'procedure' if kind == PROC else 'module', 'doc' : [],
+                    'proc' : value if kind == PROC else [value], 'vars' : []}
+            elif kind == END:
+                parent = ''
+            elif kind == DECL:
+                # as in parse_lines() the arguments of a procedure keep the last !> doc, but
+                # only the documented variables of modules and types get one
+                if not in_var_doc and self.dict.get( parent, {} ).get( 'unit' ) != 'procedure':
+                    var_doc = []
+                var = {'decl':value, 'doc':var_doc}
+                if self.linenos:
+                    var.update( line=i, own_doc=in_var_doc )
+                in_var_doc = False
+                if outer is None and _typedef.fullmatch( ''.join( value ).strip( ) ):
+                    outer  = parent
+                    parent = f"{i:05d}"
+                    self.dict[parent] = {'unit': 'type', 'doc' : [], 'proc' : [], 'vars' : [var]}
+                elif parent:
+                    self.dict[parent]['vars'].append( var )
+            elif kind == END_TYPE and outer is not None:
+                parent, outer = outer, None
 
     def clean_underscores( self, text ):
+        return _clean( text, self.links )
+
+    def __argument( self, var, all_vars=False ):
+        vv, decl, doc = self.__write_var( var, all_vars )
+        if vv is None: return None
+        return Argument( vv[0], vv[1], decl, doc )
+
+    def __proc_name( self, proc_line ):
+        words = proc_line.split( )
+        if len( words ) > 2 and words[0].lower() == 'module' and words[1].lower() == 'procedure':
+            # separate module procedure of a submodule
+            return 'procedure', words[2].split( sep='(' )[0]
+        _, elem = self.__is_in_list( procs, proc_line, out=True )
+        # get everything after proc type:
+        proc_name = proc_line.split( sep=elem )[-1]
+        # get everything before arguments (i.e. proc name):
+        proc_name = proc_name.split( sep='(' )[0]
+        # remove spaces
+        return elem, proc_name.strip( )
+
+    def __procedure( self, unit ):
+        proc_line = ''.join( unit['proc'] )
+        elem, proc_name = self.__proc_name( proc_line )
+
+        doc  = self.__docstring( unit['doc'] )
+        args = [self.__argument( v ) for v in unit['vars']] if self.write_vars else []
+        return Procedure( elem, proc_name, proc_line, doc, [a for a in args if a is not None] )
+
+    def __whole_units( self ):
+        units = []
+        for unit in self.dict.values():
+            if unit['unit'] == 'procedure':
+                units.append( self.__procedure( unit ) )
+                continue
+            doc = self.__docstring( unit['doc'] )
+            if unit['unit'] == 'module':
+                header = unit['proc'][0]
+                vvars  = [v for v in unit['vars'] if ''.join( v['doc'] ).strip( )] if self.write_vars else []
+                units.append( Module( header.split( )[0].lower(), header.split( )[-1], header, doc,
+                    [self.__argument( v, all_vars=True ) for v in vvars] ) )
+            else:
+                vvars = unit['vars']
+                match = _typedef.fullmatch( ''.join( vvars[0]['decl'] ).strip( ) )
+                units.append( TypeDef( 'type', match.group( 1 ) or match.group( 2 ), self.__argument( vvars[0], True ),
+                    doc, [self.__argument( v, True ) for v in vvars[1:]] if self.write_vars else [] ) )
+        return units
 
-        ltext = text.split( sep='$' )
-        n = len( ltext ) // 2 + 1
-        for i in range( n ):
-            ltext[2*i] = self.__clean_underscores2( ltext[2*i] )
-        return r'\xspace$\xspace '.join( ltext )
-
-    def write_proc_latex( self, text ):
-        if not (self.type or self.prog):
-            for parent in list( self.dict.keys() ):
-                proc_line = ''.join( self.dict[parent]['proc'] )
-                _, elem = self.__is_in_list( procs, proc_line, out=True )
-                # get everything after proc type:
-                proc_name = proc_line.split( sep=elem )[-1]
-                # get everything before arguments (i.e. proc name):
-                proc_name = proc_name.split( sep='(' )[0]
-                # remove spaces
-                proc_name = proc_name.strip( )
-
-                if self.depth == 1:
-                    sect = 'subsection'
-                elif self.depth == 2:
-                    sect = 'subsubsection'
-                text += "\n\\%s{%s \\ifo{%s}}\n\n" % (sect, self.__capitalize(elem), proc_name)
-                text += "\\label{%s:%s}\\index{\\code{%s}}\n\n" % (sect, proc_name, self.name)
-
-                text += '\\begin{minted}[bgcolor=codebg,linenos=false]{fortran}\n'
-                text += proc_line + '\n'
-                text += '\\end{minted}\n\n'
-
+    def names( self ):
+        """
+        Return the names of the parsed units that get a section, in order, without processing
+        the docstrings.
+        """
+        if not self.whole:
+            if self.type or self.prog:
+                return []
+            return [self.__proc_name( ''.join( unit['proc'] ) )[1] for unit in self.dict.values()]
+        names = []
+        for unit in self.dict.values():
+            if unit['unit'] == 'procedure':
+                names.append( self.__proc_name( ''.join( unit['proc'] ) )[1] )
+            elif unit['unit'] == 'module':
+                names.append( unit['proc'][0].split( )[-1] )
+            else:
+                match = _typedef.fullmatch( ''.join( unit['vars'][0]['decl'] ).strip( ) )
+                names.append( match.group( 1 ) or match.group( 2 ) )
+        return names
 
-                doc = self.__process_docstring( self.dict[parent]['doc'] )
-                text += self.write_doc_var_latex( doc, self.dict[parent]['vars'] )
+    def labels( self ):
+        """
+        Return the (name, label) of the parsed units that get a LaTeX label, in order: the
+        sections of the procedures, modules and types, or the type defined by a type file.
+        """
+        if not self.whole and self.type and not self.prog:
+            # the type is only labelled with its declaration, written with the variables
+            vvars = self.dict['']['vars'] if self.write_vars else []
+            match = _typedef.fullmatch( ''.join( vvars[0]['decl'] ).strip( ) ) if vvars else None
+            return [(match.group( 1 ) or match.group( 2 ), f"type:{match.group( 1 ) or match.group( 2 )}")] if match else []
+        sect = {1: 'subsection', 2: 'subsubsection'}.get( self.depth )
+        return [(name, f"{sect}:{name}") for name in self.names( )] if sect else []
+
+    def document( self ):
+        """
+        Return the intermediate representation (cag_ir.Document) of the parsed file. All
+        docstrings are processed here so that a CAGError is raised before anything is written.
+        """
+        if self.whole:
+            units = self.__whole_units( )
+        elif not (self.type or self.prog):
+            units = [self.__procedure( unit ) for unit in self.dict.values()]
         else:
-            doc = self.__process_docstring( self.dict['']['doc'] )
-            text += self.write_doc_var_latex( doc, self.dict['']['vars'] )
+            vvars = self.dict['']['vars'] if self.write_vars else []
+            doc   = self.__docstring( self.dict['']['doc'] )
+            units = [TypeDef( 'program' if self.prog else 'type', None, self.__argument( vvars[0] ) if vvars else None,
+                doc, [self.__argument( v ) for v in vvars[1:]] )]
 
+        return Document( self.name, self.depth, self.write_vars, units )
 
-        return text
+    def check( self ):
+        """
+        Return the sorted list of the (line number, message) of the problems of the docs of the
+        file parsed with self.linenos set: malformed or unknown tags of the docstrings and
+        arguments (with an intent) without !> doc. Line numbers start at 1.
+        """
+        problems = []
+        for unit in self.dict.values():
+            errors = []
+            self.__process_docstring( unit['doc'], errors )
+            problems += [(unit['doc_lines'][n] + 1, message) for n, message in errors]
+            for var in unit['vars']:
+                decl = ''.join( var['decl'] )
+                if 'intent' in decl.split( '::' )[0] and not var['own_doc']:
+                    names = decl.split( '::' )[-1].strip( )
+                    problems.append( (var['line'] + 1, f"argument {names} has no !> doc.") )
+        return sorted( problems )
+
+    def __docstring( self, lines ):
+        doc = self.__process_docstring( lines )
+        return Docstring( doc['core'], doc['references'], doc['history'], list( doc['orig_author'].values() ),
+            list( doc['advisor'].values() ) )
 
-    def write_doc_var_latex( self, docstring, vvars ):
-        text = ''
-        if any(c for c in docstring['core']):
-            for parag in docstring['core']:
-                text += self.__bold_font( self.clean_underscores( parag ) ) + '\n'
-            text += '\n'
+    def write_proc_latex( self, text ):
+        chunks = [text]
+        self.emit_latex( chunks.append )
+        return ''.join( chunks )
 
-        text = self.__capitalize( text )
+    def emit_latex( self, write, document=None ):
+        """
+        Write the LaTeX documentation chunk by chunk with the write callable (e.g. the write
+        method of an open file or the append method of a list).
+        """
+        if document is None:
+            document = self.document( )
+        for unit in document.units:
+            # types only have a section when found in a whole module
+            if isinstance( unit, (Procedure, Module) ) or (isinstance( unit, TypeDef ) and unit.name):
+                if document.depth == 1:
+                    sect = 'subsection'
+                elif document.depth == 2:
+                    sect = 'subsubsection'
+                write( "\n\\%s{%s \\ifo{%s}}\n\n" % (sect, self.__capitalize(unit.kind), unit.name) )
+                write( "\\label{%s:%s}\\index{\\code{%s}}\n\n" % (sect, unit.name, document.name) )
+            elif self.links is not None and isinstance( unit, TypeDef ) and unit.kind == 'type' and \
+                unit.var is not None and _typedef.fullmatch( f"{unit.var.decl} :: {unit.var.name.strip( )}" ):
+                # the type of a type file (see labels()), documented in the section of the
+                # including document, is only labelled to be linked to (e.g. with an index)
+                write( "\\label{type:%s}\n\n" % unit.var.name.strip( ) )
+
+            if isinstance( unit, (Procedure, Module) ):
+                write( '\\begin{minted}[bgcolor=codebg,linenos=false]{fortran}\n' )
+                write( unit.header + '\n' )
+                write( '\\end{minted}\n\n' )
+
+            self.emit_doc_var_latex( write, unit, document.write_vars )
+
+    def emit_doc_var_latex( self, write, unit, write_vars=True ):
+        # & and % are escaped in every chunk as it is written
+        _write = write
+        write  = lambda chunk: _write( chunk.replace('&','\\&').replace('%','\\%') )
+
+        docstring = unit.doc
+        if any(c for c in docstring.core):
+            core = [self.__text( PARAGRAPH, parag ) + '\n' for parag in docstring.core]
+            core.append( '\n' )
+            write( self.__capitalize( ''.join( core ) ) )
 
         desc = False
 
         args = False
 
-        if not self.write_vars:
-            text2  = "    \\item{\\textsf{\\textbf{Arguments}}}:\n"
-            text2  += "        Same as generic subroutine\n"
+        # The arguments are only written if at least one of them is documented
+        block = []
+        if not write_vars:
+            block.append( "    \\item{\\textsf{\\textbf{Arguments}}}:\n" )
+            block.append( "        Same as generic subroutine\n" )
         else:
-            if (self.type or self.prog) and len( vvars ):
+            if isinstance( unit, TypeDef ) and unit.var is not None:
 
                 # name of the type
-                vv, decl, doc = self.__write_var( vvars[0] )
-                vv, default   = vv
-                doc = self.__bold_font( self.__point( doc ) )
-                if default:
-                    doc += r" Initial value: \code{" + f"{vv}{default}" + r"}."
-                text2  = "\\code{%s}: \\ifo{%s} \n\n" % (vv, decl )
+                block.append( "\\code{%s}: \\ifo{%s} \n\n" % (unit.var.name, unit.var.decl ) )
                 if not desc:
-                    text2 += "\\begin{description}\n"
+                    block.append( "\\begin{description}\n" )
                     desc = True
-                text2 += "    \\item{\\textsf{\\textbf{Members}}}:\n"
-                text2 += "    \\begin{description}\n"
-                for v in vvars[1:]:
-                    vv, decl, doc = self.__write_var( v )
-                    if vv is not None:
-                        doc = self.__bold_font( self.__point( doc ) )
-                        vv, default   = vv
-                        if default:
-                            doc += r" Initial value: \code{" + f"{vv}{default}" + r"}."
-                        args = True
-                        if not desc:
-                            text += "\\begin{description}\n"
-                            desc = True
-                        descr = self.__bold_font( self.__point( self.__capitalize( self.clean_underscores( doc ) ) ) if doc else '' )
-                        text2 += "        \\item[\\code{%s}]: \\ifo{%s} \\\\\n \t\t\t %s\n" % (vv, decl, descr )
-                text2 += "    \\end{description}\n\n"
-
+                block.append( "    \\item{\\textsf{\\textbf{Members}}}:\n" )
+                block.append( "    \\begin{description}\n" )
+                vvars = unit.members
+            elif isinstance( unit, Module ):
+                block.append( "    \\item{\\textsf{\\textbf{Variables}}}:\n" )
+                block.append( "    \\begin{description}\n" )
+                vvars = unit.vars
             else:
-                text2  = "    \\item{\\textsf{\\textbf{Arguments}}}:\n"
-                text2 += "    \\begin{description}\n"
-                for v in vvars:
-                    vv, decl, doc = self.__write_var( v )
-                    if vv is not None:
-                        doc = self.__bold_font( self.__point( doc ) )
-                        vv, default   = vv
-                        if default:
-                            doc += r" Initial value: \code{" + f"{vv}{default}" + r"}."
-                        args = True
-                        if not desc:
-                            text += "\\begin{description}\n"
-                            desc = True
-                        descr = self.__bold_font( self.__point( self.__capitalize( self.clean_underscores( doc ) ) ) if doc else '' )
-                        text2 += "        \\item[\\code{%s}]: \\ifo{%s} \\\\\n \t\t\t %s\n" % (vv, decl, descr )
-                text2 += "    \\end{description}\n\n"
+                block.append( "    \\item{\\textsf{\\textbf{Arguments}}}:\n" )
+                block.append( "    \\begin{description}\n" )
+                vvars = unit.args if isinstance( unit, Procedure ) else []
+
+            for v in vvars:
+                doc = self.__text( VAR, v.doc )
+                if v.default:
+                    doc += r" Initial value: \code{" + f"{v.name}{v.default}" + r"}."
+                args = True
+                if not desc:
+                    write( "\\begin{description}\n" )
+                    desc = True
+                descr = self.__text( DESCRIPTION, doc ) if doc else ''
+                block.append( "        \\item[\\code{%s}]: \\ifo{%s} \\\\\n \t\t\t %s\n" % (v.name, v.decl, descr ) )
+            block.append( "    \\end{description}\n\n" )
 
         # if arguments is not empty
         if args:
-            text +=  text2
+            for chunk in block:
+                write( chunk )
 
-        if docstring['references']:
+        if docstring.references:
             if not desc:
-                text += "\\begin{description}\n"
+                write( "\\begin{description}\n" )
                 desc = True
-            text += "    \\item{\\textsf{\\textbf{References}}}:\n"
-            text += "    \\begin{description}\n"
-            for r in docstring['references']:
-                descr = self.__point( self.__capitalize( self.clean_underscores( docstring['references'][r] ) ) )
-                text += "        \\item[%s]: %s\n" % (r, descr )
-            text += "    \\end{description}\n\n"
-
-        if docstring['history']:
+            write( "    \\item{\\textsf{\\textbf{References}}}:\n" )
+            write( "    \\begin{description}\n" )
+            for r in docstring.references:
+                descr = self.__text( ITEM, docstring.references[r] )
+                write( "        \\item[%s]: %s\n" % (r, descr ) )
+            write( "    \\end{description}\n\n" )
+
+        if docstring.history:
             if not desc:
-                text += "\\begin{description}\n"
+                write( "\\begin{description}\n" )
                 desc = True
-            text += "    \\item{\\textsf{\\textbf{History}}}:\n"
-            text += "    \\begin{description}\n"
-            for h in docstring['history']:
-                descr = self.__point( self.__capitalize( self.clean_underscores( docstring['history'][h] ) ) )
-                text += "        \\item[%s]: %s\n" % (h, descr )
-            text += "    \\end{description}\n\n"
-
-        if docstring['orig_author']:
+            write( "    \\item{\\textsf{\\textbf{History}}}:\n" )
+            write( "    \\begin{description}\n" )
+            for h in docstring.history:
+                descr = self.__text( ITEM, docstring.history[h] )
+                write( "        \\item[%s]: %s\n" % (h, descr ) )
+            write( "    \\end{description}\n\n" )
+
+        if docstring.authors:
             if not desc:
-                text += "\\begin{description}\n"
+                write( "\\begin{description}\n" )
                 desc = True
-            text += "    \\item{\\textsf{\\textbf{Orignal author(s)}}}:\n"
-            text += "    \\begin{description}\n"
-            for oa in docstring['orig_author']:
-                descr = self.__point( self.__capitalize( self.clean_underscores( docstring['orig_author'][oa] ) ) )
-                text += "        \\item[$\\bullet$] %s\n" % (descr )
-            text += "    \\end{description}\n\n"
-
-        if docstring['advisor']:
+            write( "    \\item{\\textsf{\\textbf{Orignal author(s)}}}:\n" )
+            write( "    \\begin{description}\n" )
+            for oa in docstring.authors:
+                descr = self.__text( ITEM, oa )
+                write( "        \\item[$\\bullet$] %s\n" % (descr ) )
+            write( "    \\end{description}\n\n" )
+
+        if docstring.advisors:
             if not desc:
-                text += "\\begin{description}\n"
+                write( "\\begin{description}\n" )
                 desc = True
-            text += "    \\item{\\textsf{\\textbf{Advisor(s)}}}:\n"
-            text += "    \\begin{description}\n"
-            for a in docstring['advisor']:
-                descr = self.__point( self.__capitalize( self.clean_underscores( docstring['advisor'][a] ) ) )
-                text += "        \\item[$\\bullet$] %s\n" % (descr )
-            text += "    \\end{description}\n\n"
+            write( "    \\item{\\textsf{\\textbf{Advisor(s)}}}:\n" )
+            write( "    \\begin{description}\n" )
+            for a in docstring.advisors:
+                descr = self.__text( ITEM, a )
+                write( "        \\item[$\\bullet$] %s\n" % (descr ) )
+            write( "    \\end{description}\n\n" )
 
         if desc:
-            text += "\\end{description}\n"
-
-
-
-        return text.replace('&','\\&').replace('%','\\%')
-
-
+            write( "\\end{description}\n" )
 
-    def write_latex( self ):
-        text = "%!TEX encoding = UTF-8 Unicode\n"
-
-        text = self.write_proc_latex( text )
+    def render( self, fmt='latex', out=None, document=None, links=None ):
+        """
+        Render the parsed file in the given format (see cag_render.RENDERERS). Return the result
+        as a string, or write it chunk by chunk to out, any object with a write method (e.g. an
+        open file or an io.StringIO). links default to self.links for LaTeX.
+        """
+        from cag_render import render
+
+        if document is None:
+            document = self.document( )
+        if links is None and fmt == 'latex':
+            links = self.links
+        if out is not None:
+            render( document, fmt, out.write, links )
+            return None
+        chunks = []
+        render( document, fmt, chunks.append, links )
+        return ''.join( chunks )
+
+    def write_latex( self, document=None ):
+        """
+        Write the LaTeX documentation to self.out if it changed. Return True if it was written.
+        """
+        if document is None:
+            document = self.document( )
 
-        with open(self.out, 'w') as f:
-            f.write( text )
+        def emit( write ):
+            write( "%!TEX encoding = UTF-8 Unicode\n" )
+            self.emit_latex( write, document )
+        written = write_if_changed( self.out, emit )
 
         print(f"{GREEN}[DONE]{NO_COLOR}")
-
+        return written
+
+def document_source( source, name='<source>', fmt='latex', out=None, encoding=None, **options ):
+    """
+    Parse a source held in memory (see CAutoGenF.parse_source()) and render it (see
+    CAutoGenF.render()), e.g. from a Sphinx extension. options are the other arguments of
+    CAutoGenF (depth, ttype, pprog, write_vars, whole, links...).
+    """
+    doc = CAutoGenF( name, **options )
+    doc.parse_source( source, encoding )
+    return doc.render( fmt, out )
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+"""
+Benchmark of CAutoGenF on a synthetic Fortran corpus.
+
+The parse, docstring processing (CAutoGenF.document()) and rendering (CAutoGenF.emit_latex()
+into memory) phases are timed separately, the best of --repeat runs is kept. Every run starts
+with an empty memo of the text transforms, so that the render phase times them. The timings
+can be stored as a baseline and later runs compared to it: the script exits with status 1 if
+a phase is slower than the baseline by more than --threshold.
+
+The import time of CAutoGenF is measured in a fresh interpreter as well: it is compared to
+the baseline like the other phases, must stay below --max-import-ms, and CAutoGenF must not
+import anything outside of the standard library.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from CAutoGenF import CAutoGenF, text_cache_clear
+from gen_doc import read_list
+
+parser = argparse.ArgumentParser( description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter )
+parser.add_argument('--files', type=int, default=200, help='number of source files' )
+parser.add_argument('--procs', type=int, default=20, help='number of procedures per source file' )
+parser.add_argument('--args', type=int, default=12, help='number of arguments per procedure' )
+parser.add_argument('--cont', type=int, default=4, help='number of & continuation lines of the declarations' )
+parser.add_argument('--doc-lines', type=int, default=15, help='number of !! lines per procedure' )
+parser.add_argument('--types', type=float, default=0.1, help='fraction of files defining a type' )
+parser.add_argument('--modules', type=float, default=0.05,
+    help='fraction of files parsed as whole modules, with declarations without ::' )
+parser.add_argument('--seed', type=int, default=0 )
+parser.add_argument('--repeat', type=int, default=3, help='number of runs, the fastest one is kept' )
+parser.add_argument('--corpus', type=str, default=None, help='directory of the corpus (default: temporary)' )
+parser.add_argument('--baseline', type=str, default=None, help='JSON file with the reference timings' )
+parser.add_argument('--save-baseline', action='store_true', help='store the timings in --baseline' )
+parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative slowdown' )
+parser.add_argument('--max-import-ms', type=float, default=50., help='maximum import time of CAutoGenF' )
+
+PHASES = ('parse', 'docstring', 'render')
+
+_words = ('temperature', 'pressure', 'density', 'opacity', 'the', 'of', 'model', 'grid', 'mass', 'radius',
+    'is', 'computed', 'with', 'interpolation', 'abundance', 'convective', 'flux', 'and', 'for', 'each')
+
+def _sentence( rnd, n ):
+    words = [rnd.choice( _words ) for _ in range( n )]
+    i = rnd.randrange( n )
+    words[i] = rnd.choice( ['`%s_x`', '#%s#', '$%s_i$'] ) % words[i]
+    return ' '.join( words ) + rnd.choice( ['.', '', '?'] )
+
+def _doc_block( rnd, n ):
+    lines = [f"    !! {_sentence( rnd, 10 )}" for _ in range( n )]
+    lines.insert( len( lines )//2, "    !!" )
+    lines += ["    !!",
+        f"    !! :reference: ref{rnd.randrange( 100 )} : {_sentence( rnd, 8 )}",
+        f"    !!     {_sentence( rnd, 6 )}",
+        f"    !! :history: {2000 + rnd.randrange( 24 )} : {_sentence( rnd, 6 )}",
+        f"    !! :author: {_sentence( rnd, 3 )}",
+        f"    !! :advisor: {_sentence( rnd, 3 )}"]
+    return lines
+
+def _declaration( names, cont, intent ):
+    lines = [f"    real(dp), dimension(:), intent({intent}) :: {names[0]}, &"]
+    for name in names[1:cont]:
+        lines.append( f"         {name}, &" )
+    lines[-1] = lines[-1][:-3]
+    return lines
+
+def _procedure( rnd, i, p, nargs, cont, doc_lines ):
+    args = [f"arg_{a}" for a in range( nargs )]
+    lines = [f"  subroutine proc_{i}_{p}( {', '.join( args[:nargs//2] )}, &", f"       {', '.join( args[nargs//2:] )} )"]
+    lines += _doc_block( rnd, doc_lines )
+    for a in range( 0, nargs, cont ):
+        lines += [f"    !> {_sentence( rnd, 8 )}", f"    !> {_sentence( rnd, 5 )}", "    !>"]
+        lines += _declaration( args[a:a+cont], cont, rnd.choice( ['in', 'out', 'inout'] ) )
+    lines += ["    integer :: i", "    real(dp) :: work(10)", "", "    do i = 1, 10",
+        "       work(i) = i*arg_0(i) ! local computation", "    end do",
+        "    write(*,*) 'in subroutine', work", f"  end subroutine proc_{i}_{p}", ""]
+    return lines
+
+def make_corpus( directory, files=200, procs=20, nargs=12, cont=4, doc_lines=15, types=0.1, seed=0, modules=0.05 ):
+    """
+    Write a synthetic corpus and its list file in directory. Return the name of the list file.
+    The whole modules declare their variables and derived type without ::, as old sources do.
+    """
+    rnd = random.Random( seed )
+    os.makedirs( directory, exist_ok=True )
+    rows = []
+    for i in range( files ):
+        name = f"src_{i:05d}.f90"
+        lines = []
+        ttype  = rnd.random( ) < types
+        module = not ttype and modules and rnd.random( ) < modules
+        if module:
+            lines.append( f"module mod_{i}" )
+            lines += [l[2:] for l in _doc_block( rnd, doc_lines )]
+            lines += ["  implicit none", f"  !> {_sentence( rnd, 8 )}", f"  real(dp) origin_{i}",
+                "  !> the type", f"  type point_{i}"]
+            for j in range( nargs ):
+                lines += [f"     !> {_sentence( rnd, 8 )}", f"     real(dp) member_{j}"]
+            lines += [f"  end type point_{i}", "contains"]
+            for p in range( max( procs//4, 1 ) ):
+                lines += _procedure( rnd, i, p, nargs, cont, doc_lines )
+            lines.append( f"end module mod_{i}" )
+        elif ttype:
+            lines += [l[2:] for l in _doc_block( rnd, doc_lines )]
+            lines.append( "  !> the type" )
+            lines.append( f"  type, public :: type_{i}" )
+            for j in range( nargs ):
+                lines += [f"     !> {_sentence( rnd, 8 )}", f"     real(dp) :: member_{j} = {j}.0_dp"]
+            lines += [f"  end type type_{i}", "contains"]
+        else:
+            for p in range( procs ):
+                lines += _procedure( rnd, i, p, nargs, cont, doc_lines )
+        with open( os.path.join( directory, name ), 'w' ) as f:
+            f.write( '\n'.join( lines ) + '\n' )
+        rows.append( f"{name:30s} {name[:-4] + '.tex':30s} {rnd.choice( [1, 2] )} {int( ttype )} 1 0 {int( module )}" )
+
+    list_file = os.path.join( directory, 'list_src_files' )
+    with open( list_file, 'w' ) as f:
+        f.write( os.path.abspath( directory ) + '/\n' )
+        f.write( '# input file    output file    depth   is a type?  write variables? is a program? whole module?\n' )
+        f.write( '\n'.join( rows ) + '\n' )
+    return list_file
+
+def bench( list_file, repeat=3 ):
+    """
+    Return the best time of each phase over the rows of list_file, plus corpus counters.
+    """
+    path, rows = read_list( list_file )
+    best = dict.fromkeys( PHASES, float( 'inf' ) )
+    for _ in range( repeat ):
+        # the later runs would only hit the memo of the previous one
+        text_cache_clear( )
+        times = dict.fromkeys( PHASES, 0. )
+        size  = 0
+        for row in rows:
+            doc = CAutoGenF( path=path, **row )
+            t0 = time.perf_counter( )
+            with contextlib.redirect_stdout( io.StringIO( ) ):
+                doc.parse( )
+            t1 = time.perf_counter( )
+            document = doc.document( )
+            t2 = time.perf_counter( )
+            chunks = []
+            doc.emit_latex( chunks.append, document )
+            t3 = time.perf_counter( )
+            times['parse']     += t1 - t0
+            times['docstring'] += t2 - t1
+            times['render']    += t3 - t2
+            size += sum( len( c ) for c in chunks )
+        best = {p: min( best[p], times[p] ) for p in PHASES}
+
+    lines = 0
+    for row in rows:
+        with open( path+'/'+row['name'], 'rb' ) as f:
+            lines += f.read( ).count( b'\n' )
+    return {'times': best, 'files': len( rows ), 'lines': lines, 'output_chars': size}
+
+_import_script = """
+import os, sys, time
+before = set( sys.modules )
+t = time.perf_counter( )
+import CAutoGenF
+t = time.perf_counter( ) - t
+here = os.path.dirname( os.path.abspath( CAutoGenF.__file__ ) )
+extra = sorted( m for m in set( sys.modules ) - before if m.split( '.' )[0] not in sys.stdlib_module_names
+    and os.path.dirname( os.path.abspath( getattr( sys.modules[m], '__file__', None ) or here ) ) != here )
+print( t, *extra )
+"""
+
+def import_time( repeat=5 ):
+    """
+    Return the best import time of CAutoGenF in a fresh interpreter and the list of the non
+    standard modules it imported.
+    """
+    best = float( 'inf' )
+    for _ in range( repeat ):
+        out = subprocess.run( [sys.executable, '-c', _import_script], check=True, capture_output=True, text=True,
+            cwd=os.path.dirname( os.path.abspath( __file__ ) ) ).stdout.split( )
+        best = min( best, float( out[0] ) )
+    return best, out[1:]
+
+def compare( result, baseline, threshold ):
+    """
+    Return the list of the phases slower than the baseline by more than threshold.
+    """
+    slower = []
+    for p in ('import',) + PHASES:
+        ref = baseline['times'].get( p )
+        if ref and result['times'][p] > ref*(1 + threshold):
+            slower.append( p )
+    return slower
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    with contextlib.ExitStack( ) as stack:
+        corpus = args.corpus or stack.enter_context( tempfile.TemporaryDirectory( prefix='cag_bench' ) )
+        list_file = make_corpus( corpus, args.files, args.procs, args.args, args.cont, args.doc_lines, args.types,
+            args.seed, args.modules )
+        result = bench( list_file, args.repeat )
+    result['times']['import'], extra = import_time( )
+
+    print( f"{result['files']} files, {result['lines']} lines, {result['output_chars']} characters written" )
+    baseline = None
+    if args.baseline and not args.save_baseline and os.path.isfile( args.baseline ):
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+    for p in PHASES:
+        t = result['times'][p]
+        line = f"{p:10s} {t*1e3:10.2f} ms {result['lines']/t/1e3 if t else 0:10.1f} klines/s"
+        if baseline and baseline['times'].get( p ):
+            line += f" {(t/baseline['times'][p] - 1)*100:+7.1f} %"
+        print( line )
+    t = result['times']['import']
+    line = f"{'import':10s} {t*1e3:10.2f} ms"
+    if baseline and baseline['times'].get( 'import' ):
+        line += f" {'':18s} {(t/baseline['times']['import'] - 1)*100:+7.1f} %"
+    print( line )
+
+    failed = False
+    if extra:
+        print( f"CAutoGenF imports non standard modules: {', '.join( extra )}", file=sys.stderr )
+        failed = True
+    if t*1e3 > args.max_import_ms:
+        print( f"Import of CAutoGenF slower than {args.max_import_ms} ms", file=sys.stderr )
+        failed = True
+
+    if args.save_baseline:
+        if not args.baseline:
+            parser.error( '--save-baseline requires --baseline' )
+        with open( args.baseline, 'w' ) as f:
+            json.dump( result, f, indent=1 )
+    elif baseline:
+        slower = compare( result, baseline, args.threshold )
+        if slower:
+            print( f"Regression (> {args.threshold*100:.0f} %) in: {', '.join( slower )}", file=sys.stderr )
+            failed = True
+    sys.exit( 1 if failed else 0 )
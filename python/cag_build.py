@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import os
+import shlex
+import sys
+
+from CAutoGenF import INCLUDES, decode
+from cag_render import output_name
+
+HERE = os.path.dirname( os.path.abspath( __file__ ) )
+# modules of the generator, every output depends on them
+GENERATOR = [os.path.join( HERE, m ) for m in ('gen_doc.py', 'CAutoGenF.py', 'cag_ir.py', 'cag_render.py')]
+
+def row_args( path, row ):
+    """
+    Return the arguments of gen_doc.py --row generating a row of the list file.
+    """
+    return [path, row['name'], row['out'], str( row['depth'] ), str( int( row['ttype'] ) ),
+        str( int( row['write_vars'] ) ), str( int( row['pprog'] ) ), str( int( row.get( 'whole', False ) ) )]
+
+def outputs( row, formats=('latex',) ):
+    """
+    Return the outputs of a row, the first one being the target of its rule and depfile.
+    """
+    return [output_name( row['out'], fmt ) for fmt in formats]
+
+def depends( path, row ):
+    """
+    Return the files read to generate a row, besides the list file and the generator: its
+    source and, if the include lines are resolved, the files it includes.
+    """
+    source = os.path.join( path, row['name'] )
+    if row.get( 'includes' ) is None:
+        return [source]
+    with open( source, 'rb' ) as f:
+        text = decode( f.read( ) )
+    return [source] + INCLUDES.closure( text, os.path.dirname( source ), row['includes'] )
+
+def _make( fname ):
+    return fname.replace( '$', '$$' ).replace( ' ', '\\ ' ).replace( '#', '\\#' )
+
+def write_depfile( fname, target, deps ):
+    """
+    Write a Makefile fragment (as gcc -MD does, also read by Ninja) stating that target
+    depends on deps.
+    """
+    with open( fname, 'w' ) as f:
+        f.write( _make( target ) + ':' + ''.join( ' \\\n  ' + _make( d ) for d in deps ) + '\n' )
+
+def _command( formats, rows, options=() ):
+    includes = rows[0].get( 'includes' ) if rows else None
+    return [sys.executable, os.path.join( HERE, 'gen_doc.py' )] + [a for fmt in formats for a in ('-f', fmt)] + \
+        (['--includes'] + [a for d in includes for a in ('-I', d)] if includes is not None else []) + list( options )
+
+def make_graph( list_file, path, rows, formats=('latex',), options=() ):
+    """
+    Return a Makefile fragment with one rule per row of the list file, to be included by a
+    Makefile. The outputs of a row are regenerated by gen_doc.py --row when its source, the list
+    file or the generator changed; the depfile written by the rule adds the files it read.
+    The cag_all target builds all the outputs. options are passed on to gen_doc.py.
+
+    As an unchanged output keeps its modification time, the target of a rule is a stamp file
+    touched by gen_doc.py --row, so that the row is not run again by every later make.
+    """
+    lines = [f"# Generated by gen_doc.py from {list_file}, do not edit.", '',
+        'GEN_DOC ?= ' + shlex.join( _command( formats, rows, options ) ),
+        'GEN_DOC_DEPS = ' + ' '.join( _make( g ) for g in GENERATOR ), '',
+        'CAG_OUTPUTS = ' + ' '.join( _make( o ) for row in rows for o in outputs( row, formats ) ), '',
+        '.PHONY: cag_all', 'cag_all: $(CAG_OUTPUTS)', '']
+    for row in rows:
+        outs  = outputs( row, formats )
+        stamp = outs[0] + '.stamp'
+        args  = shlex.join( [list_file, '--row'] + row_args( path, row ) + ['--depfile', outs[0] + '.d', '--stamp', stamp] )
+        lines.append( f"{_make( stamp )}: {_make( depends( path, row )[0] )} {_make( list_file )} $(GEN_DOC_DEPS)" )
+        lines.append( f"\t$(GEN_DOC) {args.replace( '$', '$$' )}" )
+        # the outputs are written by the command of the stamp, again if one was removed
+        lines.append( f"{' '.join( _make( o ) for o in outs )}: {_make( stamp )}" )
+        lines.append( f"\t@test -f $@ || $(GEN_DOC) {args.replace( '$', '$$' )}" )
+        lines.append( f"-include {_make( outs[0] + '.d' )}" )
+        lines.append( '' )
+    return '\n'.join( lines )
+
+def _ninja( fname ):
+    return fname.replace( '$', '$$' ).replace( ' ', '$ ' ).replace( ':', '$:' )
+
+def ninja_graph( list_file, path, rows, formats=('latex',), options=() ):
+    """
+    Return a Ninja file with one build statement per row of the list file. The depfile written
+    by each build statement adds the files it read to its dependencies. options are passed on
+    to gen_doc.py.
+    """
+    lines = [f"# Generated by gen_doc.py from {list_file}, do not edit.", '',
+        'gen_doc = ' + shlex.join( _command( formats, rows, options ) ), '',
+        'rule cag',
+        '  command = $gen_doc $list --row $args --depfile $dep',
+        '  description = CAutoGenF $in',
+        '  depfile = $dep',
+        '  deps = gcc',
+        # unchanged outputs keep their modification time (see write_if_changed())
+        '  restat = 1', '']
+    for row in rows:
+        outs = outputs( row, formats )
+        lines.append( f"build {' '.join( _ninja( o ) for o in outs )}: cag {_ninja( depends( path, row )[0] )} | "
+            f"{_ninja( list_file )} " + ' '.join( _ninja( g ) for g in GENERATOR ) )
+        lines.append( f"  list = {shlex.quote( list_file ).replace( '$', '$$' )}" )
+        lines.append( f"  args = {shlex.join( row_args( path, row ) ).replace( '$', '$$' )}" )
+        lines.append( f"  dep = {shlex.quote( outs[0] + '.d' ).replace( '$', '$$' )}" )
+        lines.append( '' )
+    lines.append( 'default ' + ' '.join( _ninja( outputs( row, formats )[0] ) for row in rows ) )
+    return '\n'.join( lines ) + '\n'
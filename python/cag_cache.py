@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import hashlib
+import json
+import marshal
+import os
+import tempfile
+
+from CAutoGenF import __version__, PARSER_VERSION
+from cag_build import GENERATOR
+
+OPTIONS = ('depth', 'ttype', 'write_vars', 'pprog', 'whole')
+
+def _version( ):
+    h = hashlib.sha256( __version__.encode( ) )
+    for fname in GENERATOR:
+        with open( fname, 'rb' ) as f:
+            h.update( b'\0' + f.read( ) )
+    return h.hexdigest( )[:16]
+
+# Version of the generator stored with the keys of the outputs: a digest of its sources, so that
+# any change of the code invalidates the outputs generated before it.
+VERSION = _version( )
+
+class Manifest( ):
+    """
+    On-disk manifest of the generated outputs.
+
+    Every output file is associated to a key built from the content of its source, the options
+    of its row in the list file and the version of the generator. An output whose key did not
+    change since the last run does not need to be regenerated.
+    """
+
+    def __init__( self, fname ):
+        self.fname  = fname
+        self.hits   = 0
+        self.misses = 0
+        self.entries = {}
+        # only set for the manifest of a shard (see cag_shard)
+        self.shard   = None
+        self.symbols = None
+        if fname and os.path.isfile( fname ):
+            try:
+                with open( fname, 'r' ) as f:
+                    data = json.load( f )
+            except ( OSError, ValueError ):
+                data = {}
+            if data.get( 'version' ) == VERSION:
+                self.entries = data.get( 'entries', {} )
+                self.shard   = data.get( 'shard' )
+                self.symbols = data.get( 'symbols' )
+
+    @staticmethod
+    def key( source, row, formats=('latex',), extra='' ):
+        """
+        Key of a row of the list file given the content (bytes) of its source. extra is any
+        other input of the generation, e.g. the digest of the links of the row.
+        """
+        h = hashlib.sha256( source )
+        h.update( VERSION.encode( ) )
+        for opt in OPTIONS:
+            h.update( f"\0{opt}={row[opt]}".encode( ) )
+        h.update( ( '\0' + ','.join( formats ) ).encode( ) )
+        if extra:
+            h.update( ( '\0' + extra ).encode( ) )
+        return h.hexdigest( )
+
+    def is_fresh( self, out, key, outputs=None ):
+        """
+        True if out was generated with the same key and all the outputs (default: out) exist.
+        """
+        outputs = [out] if outputs is None else outputs
+        fresh = self.entries.get( out ) == key and all( os.path.isfile( o ) for o in outputs )
+        if fresh:
+            self.hits += 1
+            self.__done( out, key )
+        else:
+            self.misses += 1
+        return fresh
+
+    def update( self, out, key ):
+        self.entries[out] = key
+        self.__done( out, key )
+
+    def __done( self, out, key ):
+        # the manifest of a shard records the rows generated or found fresh by its run, the
+        # other entries may come from an earlier run (see cag_shard.merge())
+        if self.shard is not None:
+            self.shard.setdefault( 'keys', {} )[out] = key
+
+    def save( self ):
+        if not self.fname: return
+        tmp = self.fname + '.tmp'
+        data = {'version': VERSION, 'entries': self.entries}
+        if self.shard is not None:
+            data['shard'] = self.shard
+        if self.symbols is not None:
+            data['symbols'] = self.symbols
+        with open( tmp, 'w' ) as f:
+            json.dump( data, f, indent=1, sort_keys=True )
+        os.replace( tmp, self.fname )
+
+    def summary( self ):
+        return f"Cache: {self.hits} hit(s), {self.misses} miss(es)"
+
+class ParseCache( ):
+    """
+    Directory of parse results (CAutoGenF.dict) keyed by the content of the parsed source.
+
+    The entries are stored with marshal in a subdirectory per PARSER_VERSION, so that a cache
+    directory can be shared by several checkouts or machines running different versions. Each
+    entry is written to a temporary file and renamed, which makes concurrent writers safe. A
+    hit refreshes the modification time of the entry, and prune() removes the least recently
+    used entries once the directory is larger than max_size bytes.
+    """
+
+    MAGIC = b'CAGP\x01'
+
+    def __init__( self, directory, max_size=64*2**20 ):
+        self.directory = directory
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+
+    @staticmethod
+    def key( fname, ttype=False, pprog=False, whole=False ):
+        """
+        Key of the parse result of a file, read by blocks to hash it.
+        """
+        h = hashlib.sha256( f"{PARSER_VERSION}\0{int(ttype)}{int(pprog)}{int(whole)}\0".encode( ) )
+        with open( fname, 'rb' ) as f:
+            for block in iter( lambda: f.read( 2**16 ), b'' ):
+                h.update( block )
+        return h.hexdigest( )
+
+    @staticmethod
+    def key_data( data, ttype=False, pprog=False, whole=False, includes='' ):
+        """
+        Same as key() for the content (bytes) of a file already read. includes is the digest
+        of the files it includes, if any (see CAutoGenF.include_key()).
+        """
+        h = hashlib.sha256( f"{PARSER_VERSION}\0{int(ttype)}{int(pprog)}{int(whole)}\0".encode( ) )
+        h.update( data )
+        if includes:
+            h.update( ( '\0' + includes ).encode( ) )
+        return h.hexdigest( )
+
+    def __entry( self, key ):
+        return os.path.join( self.directory, f"v{PARSER_VERSION}", key )
+
+    def get( self, key ):
+        """
+        Return the stored parse result or None.
+        """
+        entry = self.__entry( key )
+        try:
+            with open( entry, 'rb' ) as f:
+                data = f.read( )
+            if not data.startswith( self.MAGIC ):
+                raise ValueError( 'not a parse cache entry' )
+            result = marshal.loads( data[len( self.MAGIC ):] )
+            os.utime( entry )
+        except ( OSError, EOFError, ValueError, TypeError ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put( self, key, result ):
+        """
+        Store a parse result. Failing to write (e.g. read-only shared directory) is not an error.
+        """
+        entry = self.__entry( key )
+        try:
+            os.makedirs( os.path.dirname( entry ), exist_ok=True )
+            fd, tmp = tempfile.mkstemp( dir=os.path.dirname( entry ), prefix='.tmp' )
+        except OSError:
+            return
+        try:
+            with os.fdopen( fd, 'wb' ) as f:
+                f.write( self.MAGIC )
+                marshal.dump( result, f )
+            os.replace( tmp, entry )
+        except OSError:
+            try:
+                os.unlink( tmp )
+            except OSError:
+                pass
+
+    def prune( self ):
+        """
+        Remove the least recently used entries, of any version, until the size of the cache
+        is below max_size. Return the number of removed entries.
+        """
+        entries = []
+        for root, _, files in os.walk( self.directory ):
+            for name in files:
+                if name.startswith( '.tmp' ):
+                    # being written by another process
+                    continue
+                fname = os.path.join( root, name )
+                try:
+                    st = os.stat( fname )
+                except OSError:
+                    continue
+                entries.append( (st.st_mtime, st.st_size, fname) )
+
+        size    = sum( e[1] for e in entries )
+        removed = 0
+        for _, esize, fname in sorted( entries ):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink( fname )
+            except OSError:
+                continue
+            size    -= esize
+            removed += 1
+        return removed
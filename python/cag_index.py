@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import hashlib
+import json
+import os
+
+from CAutoGenF import CAutoGenF, PARSER_VERSION
+from cag_cache import VERSION
+from cag_render import output_name
+
+def _refs( parsed ):
+    """
+    Return the sorted contents (lower case) of the backquotes of the docs of a parsed file.
+    The backquotes are paired per line and per unit, which covers the pairing of the docstring
+    paragraphs done when rendering.
+    """
+    refs = set( )
+    for unit in parsed.values():
+        docs = [unit['doc']] + [v['doc'] for v in unit['vars']]
+        for lines in docs:
+            for text in lines + [' '.join( lines )]:
+                refs.update( r.strip( ).lower( ) for r in text.split( '`' )[1::2] )
+    refs.discard( '' )
+    return sorted( refs )
+
+class SymbolIndex( ):
+    """
+    On-disk index of the procedures, types and modules documented by all the rows of the list
+    files, each mapped to its output and the label of its section.
+
+    An entry is kept per source with the hash of its content and options, so that only the
+    sources that changed are parsed again to update the index. The names of the symbols
+    referenced in backquotes by each source are stored as well: the outputs of a source only
+    depend on the symbols it references (see key()).
+    """
+
+    def __init__( self, fname ):
+        self.fname   = fname
+        self.entries = {}
+        self.updated = 0
+        self.symbols = None
+        if fname and os.path.isfile( fname ):
+            try:
+                with open( fname, 'r' ) as f:
+                    data = json.load( f )
+            except ( OSError, ValueError ):
+                data = {}
+            if data.get( 'version' ) == [VERSION, PARSER_VERSION]:
+                self.entries = data.get( 'entries', {} )
+
+    @staticmethod
+    def source_key( data, row, includes='' ):
+        h = hashlib.sha256( data )
+        h.update( f"\0{row['depth']}{int(row['ttype'])}{int(row['pprog'])}{int(row.get( 'whole', False ))}".encode( ) )
+        if includes:
+            h.update( ( '\0' + includes ).encode( ) )
+        return h.hexdigest( )
+
+    def refresh( self, path, row, data, cache=None ):
+        """
+        Update the entry of a row given the content (bytes) of its source. Return True if the
+        source had to be parsed.
+        """
+        doc   = CAutoGenF( path=path, cache=cache, **row )
+        key   = self.source_key( data, row, doc.include_key( data ) )
+        entry = self.entries.get( row['out'] )
+        if entry is not None and entry['key'] == key and entry['name'] == row['name']:
+            return False
+
+        try:
+            doc.parse_source( data )
+            labels, refs = doc.labels( ), _refs( doc.dict )
+        except OSError:
+            raise
+        except Exception:
+            # nothing is indexed, the error is reported when generating the row
+            labels, refs = [], []
+        self.entries[row['out']] = {'key': key, 'name': row['name'],
+            'symbols': [[name, label] for name, label in labels],
+            'refs': refs}
+        self.symbols  = None
+        self.updated += 1
+        return True
+
+    def update( self, path, rows, cache=None ):
+        """
+        Refresh the entries of all the rows and drop the entries of the outputs which are not
+        generated any more. The entries are kept in the order of the rows.
+        """
+        outs = [row['out'] for row in rows]
+        if list( self.entries ) != outs:
+            self.entries = {out: self.entries[out] for out in outs if out in self.entries}
+            self.symbols = None
+        for row in rows:
+            with open( path+'/'+row['name'], 'rb' ) as f:
+                self.refresh( path, row, f.read( ), cache )
+
+    def table( self ):
+        """
+        Return the map of the (lower case) symbol names to their (output, label). A symbol
+        defined by several sources is linked to its first definition, in the order of the rows.
+        """
+        if self.symbols is None:
+            self.symbols = {}
+            for out, entry in self.entries.items():
+                for name, label in entry['symbols']:
+                    self.symbols.setdefault( name.lower( ), (out, label) )
+        return self.symbols
+
+    def targets( self, out ):
+        """
+        Return the (output, label) of the symbols referenced by the source of out. The symbols
+        of out are linked to its own sections.
+        """
+        table = self.table( )
+        entry = self.entries[out]
+        own   = {name.lower( ): (out, label) for name, label in entry['symbols']}
+        targets = {}
+        for ref in entry['refs']:
+            target = own.get( ref ) or table.get( ref )
+            if target is not None:
+                targets[ref] = target
+        return targets
+
+    def links( self, out, fmt='latex' ):
+        """
+        Return the links of the symbols referenced by the source of out, as expected by the
+        links argument of CAutoGenF (and of cag_render.render()): the label of the section in
+        LaTeX, the URL of the anchor in HTML.
+        """
+        links = {}
+        for ref, (target, label) in self.targets( out ).items():
+            if fmt == 'html':
+                html = os.path.basename( output_name( target, 'html' ) )
+                links[ref] = ('' if target == out else html) + '#' + label.split( ':', 1 )[1]
+            else:
+                links[ref] = label
+        return links
+
+    def key( self, out ):
+        """
+        Digest of the targets of the references of out, to be added to its manifest key.
+        """
+        return hashlib.sha256( json.dumps( sorted( self.targets( out ).items() ) ).encode( ) ).hexdigest( )
+
+    def save( self ):
+        if not self.fname: return
+        tmp = self.fname + '.tmp'
+        with open( tmp, 'w' ) as f:
+            json.dump( {'version': [VERSION, PARSER_VERSION], 'entries': self.entries}, f, indent=1, sort_keys=True )
+        os.replace( tmp, self.fname )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import json
+
+class _Record( ):
+    """
+    Base class of the records of the intermediate representation built by CAutoGenF.document().
+    """
+    __slots__ = ()
+
+    def __init__( self, *args, **kwargs ):
+        for slot, value in zip( self.__slots__, args ):
+            setattr( self, slot, value )
+        for slot in self.__slots__[len( args ):]:
+            setattr( self, slot, kwargs.pop( slot ) )
+        if kwargs:
+            raise TypeError( f"{type(self).__name__}: unexpected fields {', '.join( kwargs )}" )
+
+    def __eq__( self, other ):
+        return type( self ) is type( other ) and all( getattr( self, s ) == getattr( other, s ) for s in self.__slots__ )
+
+    def __repr__( self ):
+        return "%s(%s)" % (type(self).__name__, ', '.join( f"{s}={getattr(self, s)!r}" for s in self.__slots__ ))
+
+    def to_dict( self ):
+        data = {'__record__': type(self).__name__}
+        for s in self.__slots__:
+            data[s] = _to_data( getattr( self, s ) )
+        return data
+
+class Docstring( _Record ):
+    """
+    core is the list of paragraphs ('\\n' separates two paragraphs), references and history map
+    a name to a description, authors and advisors are lists of descriptions.
+    """
+    __slots__ = ('core', 'references', 'history', 'authors', 'advisors')
+
+class Argument( _Record ):
+    """
+    Documented variable: argument of a procedure, member of a type or variable of a program.
+    default is the initialization ('= 1') or an empty string.
+    """
+    __slots__ = ('name', 'default', 'decl', 'doc')
+
+class Procedure( _Record ):
+    """
+    kind is 'subroutine' or 'function', header the full declaration line of the procedure.
+    """
+    __slots__ = ('kind', 'name', 'header', 'doc', 'args')
+
+class TypeDef( _Record ):
+    """
+    kind is 'type' or 'program'. var is the first declared entity (the type itself), members
+    are the following ones. name is only set for the types found while parsing a whole module,
+    which get a section of their own.
+    """
+    __slots__ = ('kind', 'name', 'var', 'doc', 'members')
+
+class Module( _Record ):
+    """
+    kind is 'module' or 'submodule', header the module statement. vars are the documented
+    module variables.
+    """
+    __slots__ = ('kind', 'name', 'header', 'doc', 'vars')
+
+class Document( _Record ):
+    """
+    Everything documented in one source file.
+    """
+    __slots__ = ('name', 'depth', 'write_vars', 'units')
+
+_records = {cls.__name__: cls for cls in (Docstring, Argument, Procedure, TypeDef, Module, Document)}
+
+def _to_data( value ):
+    if isinstance( value, _Record ):
+        return value.to_dict( )
+    if isinstance( value, list ):
+        return [_to_data( v ) for v in value]
+    if isinstance( value, dict ):
+        return {k: _to_data( v ) for k, v in value.items()}
+    return value
+
+def from_dict( data ):
+    """
+    Inverse of to_dict().
+    """
+    if isinstance( data, list ):
+        return [from_dict( v ) for v in data]
+    if isinstance( data, dict ):
+        if '__record__' in data:
+            data = dict( data )
+            cls  = _records[data.pop( '__record__' )]
+            return cls( **{k: from_dict( v ) for k, v in data.items()} )
+        return {k: from_dict( v ) for k, v in data.items()}
+    return data
+
+def dumps( document, **kwargs ):
+    return json.dumps( document.to_dict( ), **kwargs )
+
+def loads( string ):
+    return from_dict( json.loads( string ) )
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from CAutoGenF import CAutoGenF, CAGError, GREEN, NO_COLOR, failure, write_if_changed
+from cag_render import output_name, render
+
+# time spent by each stage, busy or waiting for the others
+TIMES = ('read', 'read_blocked', 'compute', 'compute_idle', 'compute_blocked', 'write', 'write_idle', 'wall')
+
+def render_row( path, row, data, formats=('latex',), cache=None ):
+    """
+    Parse and render a row of the list file given the content (bytes) of its source, without
+    writing anything: the compute stage of the pipeline. Return the message to print, the
+    error raised, if any, the list of the (output, text) and the time it took.
+    """
+    t0    = time.perf_counter( )
+    row   = dict( row )
+    links = row.pop( 'links', None ) or {}
+    log   = f"Parsing {path}/{row['name']}..."
+    texts = []
+    error = None
+    try:
+        doc = CAutoGenF( path=path, cache=cache, links=links.get( 'latex' ), **row )
+        doc.parse_source( data )
+        document = doc.document( )
+        for fmt in formats:
+            chunks = []
+            render( document, fmt, chunks.append, links.get( fmt ) )
+            texts.append( (output_name( row['out'], fmt ), ''.join( chunks )) )
+    except CAGError as e:
+        error = e.message
+        texts = []
+    except OSError:
+        raise
+    except Exception as e:
+        error = failure( e )
+        texts = []
+    return log, error, texts, time.perf_counter( ) - t0
+
+class Pipeline( ):
+    """
+    Generate the rows in three stages connected by bounded queues, so that the reads and
+    writes (slow on a network file system) overlap with the parsing and rendering:
+
+    - reader threads read the sources ahead of the compute stage,
+    - the compute stage parses and renders the stale rows, in the main thread or in jobs
+      processes,
+    - a writer thread writes the outputs.
+
+    A full queue blocks the stage feeding it, which bounds the memory held by the sources
+    and outputs in flight. The time spent by each stage, busy or waiting, is kept in times
+    (see summary()).
+    """
+
+    def __init__( self, readers=4, size=16 ):
+        self.readers = max( readers, 1 )
+        self.size    = max( size, 1 )
+        self.jobs    = 1
+        self.times   = dict.fromkeys( TIMES, 0. )
+
+    def run( self, path, rows, manifest, jobs=1, formats=('latex',), cache=None, index=None ):
+        """
+        Regenerate the rows whose manifest entry is stale, as gen_doc.generate() does, and
+        update their entries. Return the list of (file, error) and the number of outputs whose
+        content did not change. The index, if any, must be up to date.
+        """
+        self.jobs  = max( jobs, 1 )
+        self.times = dict.fromkeys( TIMES, 0. )
+        start   = time.perf_counter( )
+        lock    = threading.Lock( )
+        stop    = threading.Event( )
+        todo    = queue.Queue( )
+        sources = queue.Queue( self.size )
+        results = queue.Queue( self.size )
+        done    = []
+        failed  = []
+        for item in enumerate( rows ):
+            todo.put( item )
+
+        def spent( **times ):
+            with lock:
+                for k, t in times.items():
+                    self.times[k] += t
+
+        def put( q, item ):
+            # False if the pipeline stopped while the queue was full
+            while not stop.is_set( ):
+                try:
+                    q.put( item, timeout=0.1 )
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get( q ):
+            # None if the pipeline stopped while the queue was empty
+            while True:
+                try:
+                    return q.get( timeout=0.1 )
+                except queue.Empty:
+                    if stop.is_set( ):
+                        return None
+
+        def reader( ):
+            busy = blocked = 0.
+            try:
+                while not stop.is_set( ):
+                    try:
+                        k, row = todo.get_nowait( )
+                    except queue.Empty:
+                        break
+                    t0 = time.perf_counter( )
+                    try:
+                        with open( path+'/'+row['name'], 'rb' ) as f:
+                            item = (k, row, f.read( ), None)
+                    except OSError as e:
+                        item = (k, row, None, e)
+                    t1 = time.perf_counter( )
+                    put( sources, item )
+                    busy    += t1 - t0
+                    blocked += time.perf_counter( ) - t1
+            finally:
+                spent( read=busy, read_blocked=blocked )
+
+        def writer( ):
+            busy = idle = 0.
+            # the messages are printed in the order of the rows, the fresh rows having none
+            logs  = {}
+            first = 0
+            try:
+                while True:
+                    t0 = time.perf_counter( )
+                    item = results.get( )
+                    t1 = time.perf_counter( )
+                    idle += t1 - t0
+                    if item is None:
+                        break
+                    k, row, key, result = item
+                    logs[k] = None
+                    if result is not None:
+                        log, error, texts, _ = result
+                        unchanged = 0
+                        for fname, text in texts:
+                            if not write_if_changed( fname, lambda write: write( text ) ):
+                                unchanged += 1
+                        logs[k] = log + (f"{GREEN}[DONE]{NO_COLOR}" if error is None else '')
+                        done.append( (k, row, key, error, unchanged) )
+                    while first in logs:
+                        log = logs.pop( first )
+                        if log is not None:
+                            print( log )
+                        first += 1
+                    busy += time.perf_counter( ) - t1
+            except BaseException as e:
+                failed.append( e )
+                stop.set( )
+            finally:
+                # the messages held back by a row which was not processed, e.g. on an error
+                for k in sorted( logs ):
+                    if logs[k] is not None:
+                        print( logs[k] )
+                spent( write=busy, write_idle=idle )
+
+        threads = [threading.Thread( target=reader, daemon=True ) for _ in range( min( self.readers, len( rows ) ) )]
+        threads.append( threading.Thread( target=writer, daemon=True ) )
+        for thread in threads:
+            thread.start( )
+
+        def forward( k, row, key, result ):
+            t0 = time.perf_counter( )
+            put( results, (k, row, key, result) )
+            spent( compute=result[3], compute_blocked=time.perf_counter( ) - t0 )
+
+        pool = ProcessPoolExecutor( max_workers=self.jobs ) if self.jobs > 1 and len( rows ) > 1 else None
+        try:
+            running = {}
+            for _ in rows:
+                t0 = time.perf_counter( )
+                item = get( sources )
+                spent( compute_idle=time.perf_counter( ) - t0 )
+                if item is None:
+                    break
+                k, row, data, error = item
+                if error is not None:
+                    raise error
+
+                extra = ''
+                if index is not None:
+                    extra = index.key( row['out'] )
+                    row = dict( row, links={fmt: index.links( row['out'], fmt ) for fmt in formats} )
+                extra += CAutoGenF( row['name'], path, includes=row.get( 'includes' ) ).include_key( data )
+                key = manifest.key( data, row, formats, extra )
+                if manifest.is_fresh( row['out'], key, [output_name( row['out'], fmt ) for fmt in formats] ):
+                    put( results, (k, row, key, None) )
+                    continue
+
+                if pool is None:
+                    forward( k, row, key, render_row( path, row, data, formats, cache ) )
+                    continue
+                running[pool.submit( render_row, path, row, data, formats, cache )] = (k, row, key)
+                # at most two rows per process in flight
+                while len( running ) >= 2*self.jobs:
+                    finished, _ = wait( running, return_when=FIRST_COMPLETED )
+                    for future in finished:
+                        forward( *running.pop( future ), future.result( ) )
+            for future in list( running ):
+                forward( *running.pop( future ), future.result( ) )
+        except BaseException:
+            stop.set( )
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown( cancel_futures=True )
+            # the writer writes what was computed before it stops
+            while threads[-1].is_alive( ):
+                try:
+                    results.put( None, timeout=0.1 )
+                    break
+                except queue.Full:
+                    pass
+            threads[-1].join( )
+            self.times['wall'] = time.perf_counter( ) - start
+
+            errors    = []
+            unchanged = 0
+            for k, row, key, error, n in sorted( done, key=lambda d: d[0] ):
+                unchanged += n
+                if error is None:
+                    manifest.update( row['out'], key )
+                else:
+                    errors.append( (f"{path}/{row['name']}", error) )
+        if failed:
+            raise failed[0]
+        return errors, unchanged
+
+    def summary( self ):
+        """
+        Return the time spent by each stage and the stage which bounds the run: the busiest
+        one for its number of threads or processes.
+        """
+        t = self.times
+        wall  = max( t['wall'], 1e-9 )
+        loads = {'read': t['read']/self.readers/wall, 'compute': t['compute']/self.jobs/wall, 'write': t['write']/wall}
+        bound = max( loads, key=loads.get )
+        lines = [f"Pipeline: {t['wall']:.2f} s",
+            f"  read    {t['read']:8.2f} s in {self.readers} thread(s), {t['read_blocked']:.2f} s blocked on a full queue",
+            f"  compute {t['compute']:8.2f} s in {self.jobs} process(es), {t['compute_idle']:.2f} s waiting for "
+            f"the sources, {t['compute_blocked']:.2f} s for the writer",
+            f"  write   {t['write']:8.2f} s, {t['write_idle']:.2f} s idle",
+            f"  {'CPU' if bound == 'compute' else 'I/O'}-bound: the {bound} stage is busy {100*loads[bound]:.0f}% of the time"]
+        return '\n'.join( lines )
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import html
+import os
+import re
+
+import cag_ir
+from CAutoGenF import CAutoGenF
+from cag_ir import Module, Procedure, TypeDef
+
+_bold = re.compile( r"#([^#]*)#" )
+_code = re.compile( r"`([^`]*)`" )
+
+def _text( text ):
+    """
+    Normalize the spaces of a description and drop the LaTeX line breaks added by the parser.
+    """
+    return ' '.join( text.replace( '\\\\', ' ' ).split( ) )
+
+def _paragraphs( docstring ):
+    return [_text( p ) for p in docstring.core if p.strip( )]
+
+def _sections( docstring ):
+    """
+    Yield the title and the (label, description) items of the non-empty sections of a docstring.
+    """
+    if docstring.references:
+        yield 'References', list( docstring.references.items() )
+    if docstring.history:
+        yield 'History', list( docstring.history.items() )
+    if docstring.authors:
+        yield 'Original author(s)', [(None, a) for a in docstring.authors]
+    if docstring.advisors:
+        yield 'Advisor(s)', [(None, a) for a in docstring.advisors]
+
+def _variables( document, unit ):
+    """
+    Return the title of the list of documented variables of a unit and the list itself.
+    """
+    if not document.write_vars:
+        return None, []
+    if isinstance( unit, TypeDef ):
+        return 'Members', unit.members
+    if isinstance( unit, Module ):
+        return 'Variables', unit.vars
+    return 'Arguments', unit.args
+
+def _title( unit ):
+    if isinstance( unit, (Procedure, Module) ):
+        return unit.kind.capitalize( ), unit.name
+    if unit.name:
+        return unit.kind.capitalize( ), unit.name
+    if unit.var is not None:
+        return unit.kind.capitalize( ), unit.var.name.strip( )
+    return unit.kind.capitalize( ), None
+
+def render_latex( document, write, links=None ):
+    write( "%!TEX encoding = UTF-8 Unicode\n" )
+    CAutoGenF( document.name, depth=document.depth, write_vars=document.write_vars, links=links ).emit_latex( write,
+        document )
+
+def render_json( document, write, links=None ):
+    write( cag_ir.dumps( document, indent=1 ) )
+    write( '\n' )
+
+def _md( text ):
+    return _bold.sub( r"**\1**", text )
+
+def render_markdown( document, write, links=None ):
+    hashes = '#' * (document.depth + 1)
+    for unit in document.units:
+        kind, name = _title( unit )
+        if name is not None:
+            write( f"{hashes} {kind} `{name}`\n\n" )
+        if isinstance( unit, (Procedure, Module) ):
+            write( f"```fortran\n{unit.header}\n```\n\n" )
+        elif unit.var is not None:
+            write( f"`{unit.var.decl}`\n\n" )
+
+        for parag in _paragraphs( unit.doc ):
+            write( _md( parag ) + '\n\n' )
+
+        title, vvars = _variables( document, unit )
+        if vvars:
+            write( f"**{title}**\n\n" )
+            for v in vvars:
+                line = f"- `{v.name.strip()}` (`{v.decl}`)"
+                doc  = _text( v.doc )
+                if doc:
+                    line += ': ' + _md( doc )
+                if v.default:
+                    line += f" Initial value: `{v.name.strip()} {v.default}`."
+                write( line + '\n' )
+            write( '\n' )
+
+        for title, items in _sections( unit.doc ):
+            write( f"**{title}**\n\n" )
+            for label, descr in items:
+                write( (f"- **{label}**: " if label else "- ") + _md( descr ) + '\n' )
+            write( '\n' )
+
+def _html( text, links=None ):
+    text = html.escape( text, quote=False )
+    def code( match ):
+        url = links.get( html.unescape( match.group( 1 ) ).strip( ).lower( ) ) if links else None
+        if url is None:
+            return f"<code>{match.group( 1 )}</code>"
+        # the # of the anchor is escaped so that it is not taken for bold font
+        return f"<a href=\"{html.escape( url ).replace( '#', '&num;' )}\"><code>{match.group( 1 )}</code></a>"
+    text = _code.sub( code, text )
+    return _bold.sub( r"<strong>\1</strong>", text )
+
+def render_html( document, write, links=None ):
+    h = f"h{document.depth + 1}"
+    for unit in document.units:
+        kind, name = _title( unit )
+        write( '<section>\n' )
+        if name is not None:
+            write( f"<{h} id=\"{html.escape( name )}\">{kind} <code>{html.escape( name )}</code></{h}>\n" )
+        if isinstance( unit, (Procedure, Module) ):
+            write( f"<pre><code class=\"language-fortran\">{html.escape( unit.header )}</code></pre>\n" )
+        elif unit.var is not None:
+            write( f"<p><code>{html.escape( unit.var.decl )}</code></p>\n" )
+
+        for parag in _paragraphs( unit.doc ):
+            write( f"<p>{_html( parag, links )}</p>\n" )
+
+        title, vvars = _variables( document, unit )
+        if vvars:
+            write( f"<h{document.depth + 2}>{title}</h{document.depth + 2}>\n<dl>\n" )
+            for v in vvars:
+                write( f"<dt><code>{html.escape( v.name.strip() )}</code>: <code>{html.escape( v.decl )}</code></dt>\n" )
+                descr = _html( _text( v.doc ), links )
+                if v.default:
+                    descr += f" Initial value: <code>{html.escape( v.name.strip() + ' ' + v.default )}</code>."
+                write( f"<dd>{descr}</dd>\n" )
+            write( '</dl>\n' )
+
+        for title, items in _sections( unit.doc ):
+            write( f"<h{document.depth + 2}>{title}</h{document.depth + 2}>\n<ul>\n" )
+            for label, descr in items:
+                label = f"<strong>{html.escape( label )}</strong>: " if label else ''
+                write( f"<li>{label}{_html( descr, links )}</li>\n" )
+            write( '</ul>\n' )
+        write( '</section>\n' )
+
+RENDERERS  = {'latex': render_latex, 'markdown': render_markdown, 'html': render_html, 'json': render_json}
+EXTENSIONS = {'latex': '.tex', 'markdown': '.md', 'html': '.html', 'json': '.json'}
+
+def output_name( out, fmt ):
+    """
+    Name of the output of a row of the list file in the given format.
+    """
+    if fmt == 'latex':
+        return out
+    return os.path.splitext( out )[0] + EXTENSIONS[fmt]
+
+def render( document, fmt, write, links=None ):
+    """
+    Render a document with the write callable. links maps the (lower case) names of symbols to
+    their target in the format (see cag_index.SymbolIndex.links()), they are ignored by the
+    formats without hyperlinks.
+    """
+    RENDERERS[fmt]( document, write, links )
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import collections
+import io
+import os
+import re
+
+from CAutoGenF import decode, scan, CONTAINS, DECL, INTERFACE, END_INTERFACE, MODULE, PROC, _typedef
+
+EXTENSIONS = ('.f90', '.f95', '.f03', '.f08')
+
+_program = re.compile( r"^\s*program\s+\w+", re.I | re.M )
+
+def walk( directory ):
+    """
+    Yield the path relative to directory of the Fortran sources found in the tree, sorted by
+    name in every directory. Hidden files and directories are skipped.
+    """
+    stack = ['']
+    while stack:
+        rel = stack.pop( )
+        with os.scandir( os.path.join( directory, rel ) ) as it:
+            entries = sorted( (e for e in it if not e.name.startswith( '.' )), key=lambda e: e.name )
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir( ):
+                subdirs.append( os.path.join( rel, entry.name ) )
+            elif entry.is_file( ) and os.path.splitext( entry.name )[1].lower() in EXTENSIONS:
+                yield os.path.join( rel, entry.name )
+        stack.extend( reversed( subdirs ) )
+
+def sniff( text ):
+    """
+    Guess how a source must be documented. Return the (ttype, pprog, whole) flags of the row
+    of the list file, or None if the source defines nothing CAutoGenF documents:
+
+    - a program is documented as a program,
+    - a file with a procedure before its first contains as a procedure file,
+    - a module with procedures after its first contains as a whole module,
+    - a file defining a type before its first contains as a type.
+    """
+    if _program.search( text ):
+        return True, True, False
+    before    = True
+    interface = 0
+    found     = set( )
+    for kind, _, value in scan( io.StringIO( text ), whole=True ):
+        if kind == INTERFACE:
+            interface += 1
+        elif kind == END_INTERFACE:
+            interface = max( interface - 1, 0 )
+        elif interface:
+            continue
+        elif kind == CONTAINS:
+            before = False
+        elif kind == PROC:
+            found.add( 'proc' if before else 'module proc' )
+            if before:
+                # nothing else can change the guess
+                break
+        elif kind == DECL and before and _typedef.fullmatch( ''.join( value ).strip( ) ):
+            found.add( 'type' )
+        elif kind == MODULE:
+            found.add( 'module' )
+
+    if 'proc' in found:
+        return False, False, False
+    if 'module' in found and 'module proc' in found:
+        return False, False, True
+    if 'type' in found:
+        return True, False, False
+    return None
+
+def scan_tree( directory, write_vars=True ):
+    """
+    Build the rows of a list file from the sources of a tree. Every source is read once; the
+    ones without any !! line are skipped before being parsed. The sources of the top directory
+    are documented at depth 1, the ones of the subdirectories at depth 2.
+
+    Return the path of the sources and the rows, as read_list() does.
+    """
+    rows = []
+    for rel in walk( directory ):
+        with open( os.path.join( directory, rel ), 'rb' ) as f:
+            data = f.read( )
+        if b'!!' not in data:
+            continue
+        try:
+            flags = sniff( decode( data ) )
+        except ValueError:
+            # not decoded, kept as a procedure file so that the run reports its error
+            flags = (False, False, False)
+        if flags is None:
+            continue
+        ttype, pprog, whole = flags
+        rows.append( {'name':rel, 'out':None, 'depth':1 if os.sep not in rel else 2, 'ttype':ttype,
+            'write_vars':write_vars, 'pprog':pprog, 'whole':whole} )
+
+    # the outputs are written in the current directory, named after the sources unless two
+    # sources of different directories have the same name
+    stems = [os.path.splitext( os.path.basename( row['name'] ) )[0] for row in rows]
+    count = collections.Counter( stems )
+    for row, stem in zip( rows, stems ):
+        if count[stem] > 1:
+            stem = os.path.splitext( row['name'] )[0].replace( os.sep, '_' )
+        row['out'] = stem + '.tex'
+    return os.path.abspath( directory ), rows
+
+def format_list( path, rows ):
+    """
+    Return the content of the list file of the rows, e.g. to edit the result of a scan.
+    """
+    lines = [path + '/',
+        '# input file                    output file                         depth   is a type?  write variables? is a program?  whole module?']
+    for row in rows:
+        lines.append( f"{row['name']:31s} {row['out']:35s} {row['depth']:<7d} {int( row['ttype'] ):<11d} "
+            f"{int( row['write_vars'] ):<16d} {int( row['pprog'] ):<14d} {int( row['whole'] )}" )
+    return '\n'.join( lines ) + '\n'
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import json
+import os
+
+from cag_cache import Manifest
+
+def parse_shard( text ):
+    """
+    Return (I, N) from the I/N argument of --shard, I starting at 1.
+    """
+    try:
+        i, n = (int( v ) for v in text.split( '/' ))
+    except ValueError:
+        raise ValueError( f"invalid shard {text!r}, expected I/N" )
+    if not 1 <= i <= n:
+        raise ValueError( f"invalid shard {text!r}, I must be between 1 and N" )
+    return i, n
+
+def weights( path, rows, timings=None ):
+    """
+    Return the cost of each row: the time it took in the JSON file written by --profile-json
+    if given and the row is found in it, its source size otherwise (scaled to the times of
+    the other rows, if any).
+    """
+    sizes = [os.path.getsize( path+'/'+row['name'] ) for row in rows]
+    if not timings:
+        return sizes
+
+    with open( timings, 'r' ) as f:
+        stats = json.load( f )['rows']
+    times = {s['out']: sum( s[p] for p in ('read', 'parse', 'docstring', 'render', 'write') ) for s in stats}
+    known = [(times[row['out']], size) for row, size in zip( rows, sizes ) if row['out'] in times]
+    # time per byte of the rows with a timing, to estimate the others
+    scale = sum( t for t, _ in known ) / max( sum( s for _, s in known ), 1 )
+    return [times.get( row['out'], size*scale ) for row, size in zip( rows, sizes )]
+
+def partition( rows, n, costs ):
+    """
+    Split the rows into n shards of about the same total cost (greedily, the most costly rows
+    first, each into the least loaded shard). The result only depends on the rows and costs,
+    so that every runner computes the same shards. The rows of a shard keep their order.
+    """
+    order  = sorted( range( len( rows ) ), key=lambda k: (-costs[k], rows[k]['out'], k) )
+    loads  = [0.]*n
+    shards = [[] for _ in range( n )]
+    for k in order:
+        i = min( range( n ), key=lambda i: (loads[i], i) )
+        loads[i] += costs[k]
+        shards[i].append( k )
+    return [[rows[k] for k in sorted( shard )] for shard in shards]
+
+def merge( fnames, rows ):
+    """
+    Merge the manifests of all the shards of a run. Return the merged manifest (without file
+    name), the merged symbols of the index and the list of the problems found: shards missing
+    or given twice, rows assigned to no or several shards, rows not generated (or found up to
+    date) by the run of their shard and missing outputs.
+    """
+    merged   = Manifest( None )
+    symbols  = {}
+    problems = []
+    assigned = {}
+    count    = None
+    seen     = set( )
+    for fname in fnames:
+        shard = Manifest( fname )
+        if shard.shard is None:
+            problems.append( f"{fname}: not the manifest of a shard" )
+            continue
+        i, n = shard.shard['index'], shard.shard['count']
+        if count is not None and n != count:
+            problems.append( f"{fname}: shard {i}/{n} of a run with {count} shards" )
+        count = n if count is None else count
+        if i in seen:
+            problems.append( f"{fname}: shard {i}/{n} given twice" )
+        seen.add( i )
+
+        keys = shard.shard.get( 'keys', {} )
+        for out, outputs in shard.shard['rows'].items():
+            assigned.setdefault( out, [] ).append( fname )
+            # an entry of an earlier run is not enough, e.g. if the row failed in this one
+            if out not in shard.entries or keys.get( out ) != shard.entries[out]:
+                problems.append( f"{fname}: {out} was not generated" )
+                continue
+            merged.update( out, shard.entries[out] )
+            problems += [f"{fname}: {o} is missing" for o in outputs if not os.path.isfile( o )]
+        symbols.update( shard.symbols or {} )
+
+    if count is not None:
+        problems += [f"shard {i}/{count} is missing" for i in range( 1, count+1 ) if i not in seen]
+    for row in rows:
+        shards = assigned.pop( row['out'], [] )
+        if not shards:
+            problems.append( f"{row['out']} was assigned to no shard" )
+        elif len( shards ) > 1:
+            problems.append( f"{row['out']} was generated by several shards: {', '.join( shards )}" )
+    problems += [f"{out} is not in the list file" for out in assigned]
+    return merged, symbols, problems
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Code d'Evolution Stellaire, Adaptatif et Modulaire for the 2020 decade.
+# Copyright (c) 1997-2023 The Cesam2k20 authors
+# SPDX-License-Identifier : GPL-3.0-or-later
+
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+
+from CAutoGenF import CAutoGenF, GREEN, NO_COLOR, text_cache_info, write_if_changed
+from cag_ir import Procedure
+from cag_render import output_name, render
+
+PHASES   = ('read', 'parse', 'docstring', 'render', 'write')
+COUNTERS = ('lines', 'procedures', 'variables', 'doc_lines', 'bytes')
+
+def process_row( path, row, formats=('latex',), cache=None, links=None ):
+    """
+    Same as gen_doc.run_row() but time each phase of the generation of a row and count what
+    was processed. Return a dict with the wall time of every phase in PHASES and the counters
+    in COUNTERS.
+    """
+    stats = {'file': path+'/'+row['name'], 'out': row['out'], 'unchanged': 0}
+    stats.update( dict.fromkeys( PHASES, 0. ) )
+    stats.update( dict.fromkeys( COUNTERS, 0 ) )
+
+    t = [time.perf_counter( )]
+    def lap( ):
+        t.append( time.perf_counter( ) )
+        return t[-1] - t[-2]
+
+    info = text_cache_info( )
+    print(f"Parsing {path}/{row['name']}...", end='')
+    doc = CAutoGenF( path=path, cache=cache, links=(links or {}).get( 'latex' ), **row )
+    with open( path+'/'+row['name'], 'rb' ) as f:
+        data = f.read( )
+    stats['read'] = lap( )
+
+    doc.parse_source( data )
+    stats['parse'] = lap( )
+    stats['lines'] = data.count( b'\n' ) + (bool( data ) and not data.endswith( b'\n' ))
+
+    document = doc.document( )
+    stats['docstring'] = lap( )
+    stats['procedures'] = sum( isinstance( u, Procedure ) for u in document.units )
+    stats['variables']  = sum( len( d['vars'] ) for d in doc.dict.values() )
+    stats['doc_lines']  = sum( len( d['doc'] ) + sum( len( v['doc'] ) for v in d['vars'] ) for d in doc.dict.values() )
+
+    for fmt in formats:
+        chunks = []
+        render( document, fmt, chunks.append, (links or {}).get( fmt ) )
+        text = ''.join( chunks )
+        stats['render'] += lap( )
+        if not write_if_changed( output_name( row['out'], fmt ), lambda write: write( text ) ):
+            stats['unchanged'] += 1
+        stats['bytes'] += len( text.encode( ) )
+        stats['write'] += lap( )
+
+    print(f"{GREEN}[DONE]{NO_COLOR}")
+    # hits and misses of the memo of the text transforms while rendering the row
+    stats['text_hits']   = text_cache_info( ).hits - info.hits
+    stats['text_misses'] = text_cache_info( ).misses - info.misses
+    return stats
+
+def total( stats ):
+    return sum( stats[p] for p in PHASES )
+
+def table( rows, top=10 ):
+    """
+    Return the table of the top slowest rows and of the totals.
+    """
+    rows  = sorted( rows, key=total, reverse=True )
+    width = max( [len( 'total' )] + [len( os.path.basename( s['file'] ) ) for s in rows[:top]] )
+    head  = f"{'file':{width}s} {'total':>9s} " + ' '.join( f"{p:>9s}" for p in PHASES ) \
+        + ' ' + ' '.join( f"{c:>10s}" for c in COUNTERS )
+    lines = [head, '-'*len( head )]
+    def line( name, s ):
+        return f"{name:{width}s} {total( s )*1e3:9.2f} " + ' '.join( f"{s[p]*1e3:9.2f}" for p in PHASES ) \
+            + ' ' + ' '.join( f"{s[c]:10d}" for c in COUNTERS )
+    for s in rows[:top]:
+        lines.append( line( os.path.basename( s['file'] ), s ) )
+    lines.append( '-'*len( head ) )
+    lines.append( line( 'total', totals( rows ) ) )
+    lines.append( "(times in ms)" )
+    t = totals( rows )
+    if t['text_hits'] + t['text_misses']:
+        lines.append( f"Text transforms: {t['text_hits']} hit(s), {t['text_misses']} miss(es), "
+            f"{100*t['text_hits']/(t['text_hits'] + t['text_misses']):.1f} % hit rate" )
+    return '\n'.join( lines )
+
+def totals( rows ):
+    t = {k: sum( s.get( k, 0 ) for s in rows ) for k in PHASES + COUNTERS + ('text_hits', 'text_misses')}
+    t['files'] = len( rows )
+    return t
+
+def dump_json( rows, fname ):
+    with open( fname, 'w' ) as f:
+        json.dump( {'rows': rows, 'totals': totals( rows )}, f, indent=1 )
+
+def profile_row( path, row, fname, formats=('latex',), cache=None, top=20 ):
+    """
+    Run process_row() on a row under cProfile, write the profile to fname (pstats format) and
+    return the report of the top functions sorted by cumulative time.
+    """
+    profile = cProfile.Profile( )
+    with contextlib.redirect_stdout( io.StringIO( ) ):
+        profile.runcall( process_row, path, row, formats, cache )
+    profile.dump_stats( fname )
+    out = io.StringIO( )
+    pstats.Stats( profile, stream=out ).sort_stats( 'cumulative' ).print_stats( top )
+    return out.getvalue( )
@@ -7,26 +7,500 @@
 
 
 import argparse
+import contextlib
+import functools
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from CAutoGenF import CAutoGenF
+from CAutoGenF import CAutoGenF, CAGError, GREEN, NO_COLOR, failure, write_if_changed
+from cag_build import depends, make_graph, ninja_graph, outputs, write_depfile
+from cag_cache import Manifest, ParseCache
+from cag_index import SymbolIndex
+from cag_pipeline import Pipeline
+from cag_render import RENDERERS, output_name, render
+from cag_scan import format_list, scan_tree
+from cag_shard import merge, parse_shard, partition, weights
+import cag_stats
 
 parser = argparse.ArgumentParser()
-parser.add_argument('list', type=str, default=None, help='file name with list of files' )
+parser.add_argument('list', type=str, nargs='?', default=None, help='file name with list of files' )
+parser.add_argument('--scan', type=str, default=None, metavar='DIR',
+    help='document the sources found in DIR instead of the ones of a list file' )
+parser.add_argument('--write-list', type=str, default=None, metavar='FILE',
+    help='write the rows found by --scan to FILE, in the format of the list file, and exit' )
+parser.add_argument('--cache', type=str, default='.gen_doc_cache.json',
+    help='manifest used to skip the files that did not change since the last run' )
+parser.add_argument('--no-cache', action='store_true', help='regenerate every file' )
+parser.add_argument('--parse-cache', type=str, default=None, metavar='DIR',
+    help='directory where the parse results are stored, may be shared between checkouts' )
+parser.add_argument('--parse-cache-size', type=float, default=64, metavar='MB',
+    help='maximum size of the parse cache directory (default: 64 MB)' )
+parser.add_argument('--index', type=str, default=None, metavar='FILE',
+    help='link the identifiers in backquotes to the procedures, types and modules documented by any row, '
+    'with the index of the symbols of all the rows stored in FILE' )
+parser.add_argument('--includes', action='store_true',
+    help='merge the docs and declarations of the files included by the sources (include or #include lines) '
+    'into the units including them; the files are searched in the directory of the including file' )
+parser.add_argument('-I', '--include-dir', type=str, action='append', default=None, metavar='DIR',
+    help='also search the included files in DIR, may be repeated (implies --includes)' )
+parser.add_argument('--check', action='store_true',
+    help='only check the docs of the sources (tags of the docstrings, undocumented arguments), write nothing' )
+parser.add_argument('--make', type=str, default=None, metavar='FILE',
+    help='write a Makefile fragment with one rule per row, to be included by a Makefile, and exit' )
+parser.add_argument('--ninja', type=str, default=None, metavar='FILE',
+    help='write a Ninja file with one build statement per row and exit' )
+parser.add_argument('--row', type=str, nargs='+', default=None,
+    metavar=('PATH', 'NAME OUT DEPTH TTYPE WRITE_VARS PPROG [WHOLE]'),
+    help='generate only the given row (the path of the sources, then the columns of a line of the list '
+    'file), whatever the manifest; used by the rules of --make and --ninja' )
+parser.add_argument('--depfile', type=str, default=None, metavar='FILE',
+    help='with --row, write the files read (source and list file) to FILE, as a Makefile rule' )
+parser.add_argument('--stamp', type=str, default=None, metavar='FILE',
+    help='with --row, touch FILE once the outputs are generated (they keep their modification time when '
+    'unchanged), FILE being the target of the --depfile; used by the rules of --make' )
+parser.add_argument('--shard', type=str, default=None, metavar='I/N',
+    help='only generate the I-th of N shards of the rows, e.g. on one of N CI runners; the manifest '
+    'records the rows of the shard' )
+parser.add_argument('--shard-timings', type=str, default=None, metavar='FILE',
+    help='balance the shards with the timings of a previous run (written by --profile-json) '
+    'instead of the sizes of the sources' )
+parser.add_argument('--merge', type=str, nargs='+', default=None, metavar='MANIFEST',
+    help='merge the manifests of the shards of a run into --cache (and their symbols into --index), '
+    'after checking that every row was generated by exactly one shard' )
+parser.add_argument('--pipeline', action='store_true',
+    help='read the sources with --readers threads and write the outputs with another one while the '
+    'others are parsed and rendered, and print the time spent by each stage' )
+parser.add_argument('--readers', type=int, default=4, metavar='N',
+    help='number of threads reading the sources with --pipeline (default: 4)' )
+parser.add_argument('--queue-size', type=int, default=16, metavar='N',
+    help='number of sources read ahead and of outputs waiting to be written with --pipeline (default: 16)' )
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of files processed in parallel' )
+parser.add_argument('-f', '--format', action='append', choices=list( RENDERERS ),
+    help='output format, may be repeated to write several formats from a single parse (default: latex)' )
+parser.add_argument('-w', '--watch', action='store_true',
+    help='keep running and regenerate the documentation of the sources (and list) when they change' )
+parser.add_argument('--interval', type=float, default=0.2, help='polling interval of --watch in seconds' )
+parser.add_argument('--stats', action='store_true',
+    help='time each phase of every file and print the slowest files' )
+parser.add_argument('--stats-top', type=int, default=10, metavar='N',
+    help='number of files printed by --stats (default: 10)' )
+parser.add_argument('--profile-json', type=str, default=None, metavar='FILE',
+    help='write the timings and counters of every file to FILE in JSON' )
+parser.add_argument('--cprofile', type=str, default=None, metavar='FILE',
+    help='run the slowest file again under cProfile and write the profile to FILE' )
 
-if __name__ == '__main__':
-
-    args = parser.parse_args()
+def parse_row( file ):
+    """
+    Return the row (CAutoGenF arguments) given by the columns of a line of the list file, or
+    None if they are not a row.
+    """
+    # the 7th column (whole module?) is optional
+    if len( file ) in (6, 7):
+        return {'name':file[0], 'out':file[1], 'depth':int(file[2]), 'ttype':bool(int(file[3])),
+            'write_vars':bool(int(file[4])), 'pprog':bool(int(file[5])),
+            'whole':len( file ) == 7 and bool(int(file[6]))}
+    return None
 
-    with open( args.list, 'r' ) as f:
+def read_list( fname ):
+    """
+    Read the list of files. Return the path of the sources and the rows as CAutoGenF arguments.
+    """
+    with open( fname, 'r' ) as f:
         files = f.readlines()
 
     path = files[0].replace( '\n', '')
 
+    rows = []
     for file in files[1:]:
         if file[0][0] != '#':
-            file = file.split( )
-            if len( file ) == 6:
-                doc = CAutoGenF( file[0], out=file[1], path=path, depth=int(file[2]), ttype=bool(int(file[3])),
-                    write_vars=bool(int(file[4])), pprog=bool(int(file[5])) )
-                doc.parse()
-                doc.write_latex( )
+            row = parse_row( file.split( ) )
+            if row is not None:
+                rows.append( row )
+    return path, rows
+
+def with_includes( rows, includes ):
+    """
+    Return the rows with the includes argument of CAutoGenF, unchanged if includes is None.
+    """
+    if includes is None:
+        return rows
+    return [dict( row, includes=includes ) for row in rows]
+
+def run_row( path, row, formats=('latex',), cache=None, stats=False ):
+    """
+    Generate the documentation of one row of the list file in each of the given formats.
+
+    Return the messages printed while processing the row, the error raised, if any, so that
+    the caller can print them in the order of the list whatever the process that did the job,
+    the number of outputs left untouched because their content did not change and, if stats
+    is True, the timings and counters of cag_stats.process_row().
+
+    The row may have a 'links' entry mapping each format to the links of its symbols.
+    """
+    row   = dict( row )
+    links = row.pop( 'links', None ) or {}
+    log = io.StringIO( )
+    error = None
+    unchanged = 0
+    timings = None
+    with contextlib.redirect_stdout( log ):
+        try:
+            if stats:
+                timings = cag_stats.process_row( path, row, formats, cache, links )
+                return log.getvalue( ), error, timings['unchanged'], timings
+            doc = CAutoGenF( path=path, cache=cache, links=links.get( 'latex' ), **row )
+            doc.parse()
+            document = doc.document( )
+            for fmt in formats:
+                if fmt != 'latex':
+                    if not write_if_changed( output_name( row['out'], fmt ), lambda w: render( document, fmt, w, links.get( fmt ) ) ):
+                        unchanged += 1
+            if 'latex' in formats:
+                if not doc.write_latex( document ):
+                    unchanged += 1
+            else:
+                print(f"{GREEN}[DONE]{NO_COLOR}")
+        except CAGError as e:
+            error = e.message
+        except OSError:
+            raise
+        except Exception as e:
+            # e.g. a construct the parser does not handle, in a source found by --scan
+            error = failure( e )
+    return log.getvalue( ), error, unchanged, timings
+
+def check_row( path, row ):
+    """
+    Return the list of the (line number, message) of the problems of the docs of a row.
+    """
+    doc = CAutoGenF( path=path, **row )
+    doc.linenos = True
+    with open( path+'/'+row['name'], 'rb' ) as f:
+        data = f.read( )
+    try:
+        doc.parse_source( data )
+        return doc.check( )
+    except OSError:
+        raise
+    except Exception as e:
+        return [(1, failure( e ))]
+
+def run( path, rows, jobs=1, task=run_row, **kwargs ):
+    """
+    Process the rows, in parallel if jobs > 1. Yield the results of task (run_row() by default)
+    in order.
+    """
+    func = functools.partial( task, path, **kwargs )
+    if jobs > 1 and len( rows ) > 1:
+        with ProcessPoolExecutor( max_workers=min( jobs, len( rows ) ) ) as pool:
+            yield from pool.map( func, rows )
+    else:
+        yield from map( func, rows )
+
+def generate( path, rows, manifest, jobs=1, formats=('latex',), cache=None, stats=None, index=None,
+    all_rows=None, pipeline=None ):
+    """
+    Regenerate the rows whose manifest entry is stale. Return the list of (file, error) and the
+    number of outputs whose content did not change. If stats is a list, the timings of every
+    regenerated row are appended to it. If an index (cag_index.SymbolIndex) is given, it is
+    updated with the symbols of all the rows (all_rows if only some of them are generated)
+    first and the references to them are linked. If a pipeline (cag_pipeline.Pipeline) is
+    given, the rows go through it instead.
+    """
+    if index is not None:
+        index.update( path, all_rows or rows, cache )
+        index.save( )
+
+    if pipeline is not None:
+        try:
+            return pipeline.run( path, rows, manifest, jobs, formats, cache, index )
+        finally:
+            manifest.save( )
+            if cache is not None:
+                cache.prune( )
+
+    stale = []
+    for row in rows:
+        extra = ''
+        if index is not None:
+            extra = index.key( row['out'] )
+            row = dict( row, links={fmt: index.links( row['out'], fmt ) for fmt in formats} )
+        with open( path+'/'+row['name'], 'rb' ) as f:
+            data = f.read( )
+        extra += CAutoGenF( row['name'], path, includes=row.get( 'includes' ) ).include_key( data )
+        key = manifest.key( data, row, formats, extra )
+        if not manifest.is_fresh( row['out'], key, [output_name( row['out'], fmt ) for fmt in formats] ):
+            stale.append( (row, key) )
+
+    errors    = []
+    unchanged = 0
+    try:
+        results = run( path, [row for row, _ in stale], jobs, formats=formats, cache=cache, stats=stats is not None )
+        for (row, key), (log, error, n, timings) in zip( stale, results ):
+            print( log, end='' )
+            unchanged += n
+            if timings is not None:
+                stats.append( timings )
+            if error is None:
+                manifest.update( row['out'], key )
+            else:
+                print( )
+                errors.append( (f"{path}/{row['name']}", error) )
+    finally:
+        manifest.save( )
+        if cache is not None:
+            cache.prune( )
+    return errors, unchanged
+
+def check( path, rows, manifest, jobs=1 ):
+    """
+    Check the sources of the rows, each of them once, and print their problems. The sources
+    without problems are stored in the manifest, so that they are not checked again until they
+    change. Return the number of problems.
+    """
+    sources = {}
+    for row in rows:
+        sources.setdefault( row['name'], row )
+
+    stale = []
+    for row in sources.values():
+        with open( path+'/'+row['name'], 'rb' ) as f:
+            data = f.read( )
+        # the problems do not depend on the options of the output
+        key = Manifest.key( data, dict( row, depth=0, write_vars=True ), ('check',),
+            CAutoGenF( row['name'], path, includes=row.get( 'includes' ) ).include_key( data ) )
+        if not manifest.is_fresh( 'check:'+row['name'], key, [] ):
+            stale.append( (row, key) )
+
+    count = 0
+    try:
+        for (row, key), problems in zip( stale, run( path, [row for row, _ in stale], jobs, check_row ) ):
+            for line, message in problems:
+                print( f"{path}/{row['name']}:{line}: {message}" )
+            count += len( problems )
+            if not problems:
+                manifest.update( 'check:'+row['name'], key )
+    finally:
+        manifest.save( )
+    return count
+
+def report( manifest, errors, unchanged=0 ):
+    print( manifest.summary( ) + f", {unchanged} unchanged output(s)" )
+    for name, error in errors:
+        print( f"{name}: {error}", file=sys.stderr )
+
+def _stat( fname ):
+    try:
+        st = os.stat( fname )
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _tree_stat( directory ):
+    """
+    Modification times of the directories of a tree, which change when a file is added or removed.
+    """
+    stats = []
+    stack = [directory]
+    while stack:
+        d = stack.pop( )
+        stats.append( _stat( d ) )
+        try:
+            with os.scandir( d ) as it:
+                stack.extend( e.path for e in it if e.is_dir( ) and not e.name.startswith( '.' ) )
+        except OSError:
+            pass
+    return stats
+
+def _included( path, row ):
+    """
+    Return the files included by the source of a row, none if it cannot be read.
+    """
+    try:
+        return depends( path, row )[1:]
+    except OSError:
+        return []
+
+def watch( fname, manifest, interval=0.2, scan=False, includes=None, **kwargs ):
+    """
+    Poll the list file and the sources it lists (modification time and size), and regenerate
+    the rows whose source changed, or that were added or modified in the list file. If scan is
+    True, fname is a directory scanned again whenever a file is added to or removed from it.
+    If includes is not None, the files included by the sources are polled as well and the rows
+    including a file which changed are regenerated.
+    """
+    list_stat  = None
+    path, rows = None, []
+    sources    = {}
+    # files included by each source, and their stats
+    included   = {}
+    inc_stats  = {}
+    stat       = _tree_stat if scan else _stat
+    print( f"Watching {fname} (Ctrl-C to stop)" )
+    while True:
+        changed = []
+        if stat( fname ) != list_stat:
+            list_stat = stat( fname )
+            old_path, old_rows = path, {tuple( row.items() ) for row in rows}
+            path, rows = scan_tree( fname ) if scan else read_list( fname )
+            rows = with_includes( rows, includes )
+            changed = [row for row in rows if path != old_path or tuple( row.items() ) not in old_rows]
+            sources = {row['name']: _stat( path+'/'+row['name'] ) for row in rows}
+            if includes is not None:
+                included = {row['name']: _included( path, row ) for row in rows}
+        for row in rows:
+            st = _stat( path+'/'+row['name'] )
+            if st != sources[row['name']]:
+                sources[row['name']] = st
+                changed += [r for r in rows if r['name'] == row['name'] and r not in changed]
+                if includes is not None:
+                    included[row['name']] = _included( path, row )
+        for inc in dict.fromkeys( f for files in included.values() for f in files ):
+            st = _stat( inc )
+            if inc in inc_stats and st != inc_stats[inc]:
+                changed += [r for r in rows if inc in included[r['name']] and r not in changed]
+            inc_stats[inc] = st
+
+        if changed:
+            manifest.hits = manifest.misses = 0
+            try:
+                # a change of the symbols of a source may change the links of any row
+                todo = rows if kwargs.get( 'index' ) is not None else changed
+                report( manifest, *generate( path, todo, manifest, **kwargs ) )
+            except OSError as e:
+                # e.g. a source removed or being saved
+                print( e, file=sys.stderr )
+        time.sleep( interval )
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    formats  = tuple( dict.fromkeys( args.format or ['latex'] ) )
+    includes = None
+    if args.includes or args.include_dir:
+        includes = tuple( os.path.abspath( d ) for d in args.include_dir or [] )
+    cache = None
+    if args.parse_cache:
+        cache = ParseCache( args.parse_cache, int( args.parse_cache_size*2**20 ) )
+
+    if args.row:
+        # a single row, whose outputs are known to be stale by make or ninja
+        # the name is kept as in the list file, it is written in the outputs
+        path = args.row[0]
+        row  = parse_row( args.row[1:] )
+        if row is None:
+            parser.error( '--row requires 7 or 8 values' )
+        row = with_includes( [row], includes )[0]
+        log, error, _, _ = run_row( path, row, formats, cache )
+        print( log, end='' )
+        if error is not None:
+            print( f"\n{path}/{row['name']}: {error}", file=sys.stderr )
+            sys.exit( 1 )
+        if cache is not None:
+            cache.prune( )
+        if args.stamp:
+            with open( args.stamp, 'w' ):
+                pass
+        if args.depfile:
+            write_depfile( args.depfile, args.stamp or outputs( row, formats )[0],
+                depends( path, row ) + ([args.list] if args.list else []) )
+        sys.exit( 0 )
+
+    if (args.list is None) == (args.scan is None):
+        parser.error( 'either a list file or --scan is required' )
+    if args.write_list and not args.scan:
+        parser.error( '--write-list requires --scan' )
+
+    if args.write_list:
+        with open( args.write_list, 'w' ) as f:
+            f.write( format_list( *scan_tree( args.scan ) ) )
+        sys.exit( 0 )
+
+    manifest = Manifest( None if args.no_cache else args.cache )
+    index    = SymbolIndex( args.index ) if args.index else None
+    pipeline = None
+    if args.pipeline:
+        if args.stats or args.profile_json or args.cprofile:
+            parser.error( '--pipeline times the stages, not the files: it excludes --stats, --profile-json and --cprofile' )
+        pipeline = Pipeline( args.readers, args.queue_size )
+
+    if args.watch:
+        try:
+            watch( args.scan or args.list, manifest, args.interval, scan=args.scan is not None, jobs=args.jobs,
+                includes=includes, formats=formats, cache=cache, index=index, pipeline=pipeline )
+        except KeyboardInterrupt:
+            sys.exit( 0 )
+
+    stats = None
+    if args.stats or args.profile_json or args.cprofile:
+        stats = []
+
+    path, rows = scan_tree( args.scan ) if args.scan else read_list( args.list )
+    rows = with_includes( rows, includes )
+    if args.make or args.ninja:
+        if args.scan:
+            parser.error( '--make and --ninja require a list file' )
+        if index is not None:
+            parser.error( '--index is not supported by --make and --ninja: the links of a row need the symbols '
+                'of all the rows' )
+        # passed on to the --row of every rule
+        options = []
+        if args.parse_cache:
+            options = ['--parse-cache', os.path.abspath( args.parse_cache ), '--parse-cache-size', str( args.parse_cache_size )]
+        for fname, graph in ((args.make, make_graph), (args.ninja, ninja_graph)):
+            if fname:
+                write_if_changed( fname, lambda write: write( graph( args.list, path, rows, formats, options ) ) )
+        sys.exit( 0 )
+
+    if args.merge:
+        merged, symbols, problems = merge( args.merge, rows )
+        for problem in problems:
+            print( problem, file=sys.stderr )
+        if problems:
+            sys.exit( 1 )
+        merged.fname = None if args.no_cache else args.cache
+        merged.save( )
+        if index is not None:
+            index.entries = {row['out']: symbols[row['out']] for row in rows if row['out'] in symbols}
+            index.save( )
+        print( f"Merged {len( args.merge )} shard(s), {len( rows )} row(s)" )
+        sys.exit( 0 )
+
+    all_rows = rows
+    if args.shard:
+        try:
+            i, n = parse_shard( args.shard )
+        except ValueError as e:
+            parser.error( str( e ) )
+        rows = partition( rows, n, weights( path, rows, args.shard_timings ) )[i-1]
+        manifest.shard = {'index': i, 'count': n, 'rows': {row['out']: outputs( row, formats ) for row in rows},
+            'keys': {}}
+        print( f"Shard {i}/{n}: {len( rows )} of {len( all_rows )} row(s)" )
+
+    if args.check:
+        count = check( path, rows, manifest, args.jobs )
+        print( f"{count} problem(s) in the docs of {len( {row['name'] for row in rows} )} source(s)" )
+        sys.exit( 1 if count else 0 )
+
+    errors, unchanged = generate( path, rows, manifest, args.jobs, formats, cache, stats, index, all_rows, pipeline )
+    if manifest.shard is not None and index is not None:
+        manifest.symbols = {row['out']: index.entries[row['out']] for row in rows}
+        manifest.save( )
+    report( manifest, errors, unchanged )
+    if pipeline is not None:
+        print( pipeline.summary( ) )
+
+    if stats:
+        if args.stats:
+            print( cag_stats.table( stats, args.stats_top ) )
+        if args.profile_json:
+            cag_stats.dump_json( stats, args.profile_json )
+        if args.cprofile:
+            hottest = max( stats, key=cag_stats.total )
+            row = next( r for r in rows if path+'/'+r['name'] == hottest['file'] and r['out'] == hottest['out'] )
+            print( f"cProfile of {hottest['file']}:" )
+            print( cag_stats.profile_row( path, row, args.cprofile, formats, cache ) )
+    sys.exit( 1 if errors else 0 )